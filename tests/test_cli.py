@@ -0,0 +1,174 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+
+from voyager import cli
+from voyager.cli import _cli_app_name_codes, _cli_parse_vessels
+from voyager.dwca import DwCA
+from voyager.imma import IMMA
+from voyager.occurrences import Occurrences
+
+
+def write_log(file_path, date_from, date_to):
+    # A daily IMMA log, heading steadily south east
+    lines = []
+    for i, date in enumerate(pd.date_range(date_from, date_to)):
+        core = f'{date.year:4d}{date.month:2d}{date.day:2d}{"":4}{-i * 5:5d}{i * 5:6d}'
+        lines.append(core.ljust(108))
+    file_path.write_text('\n'.join(lines) + '\n')
+
+
+class FakeGBIF():
+
+    name_index_loads = 0
+
+    def get_name_index(self):
+        FakeGBIF.name_index_loads += 1
+
+    def get_version(self):
+        return 'test'
+
+
+class FakeWikipedia():
+
+    def find_voyage(self, vessel, year_from, year_to):
+        return None
+
+
+class FakeOccurrences(Occurrences):
+
+    # Writes the dates of the route it was given as its DwC-A output
+
+    def __init__(self, route, gbif, **kwargs):
+        self.route = route
+        self.df = pd.DataFrame({'gbifID': [1]})
+
+    def to_dwca(self, file_path):
+        file_path.write_text(f'{self.route.date_from} {self.route.date_to}')
+
+    def get_stats(self):
+        return {'errors': {}, 'total': 1}
+
+
+def test_app_name_codes():
+    names = {}
+    assert _cli_app_name_codes(names, pd.Series(['Aurelia', 'Salpa', 'Aurelia'])) == [0, 1, 0]
+    assert _cli_app_name_codes(names, pd.Series(['Salpa', 'Velella'])) == [1, 2]
+    assert list(names) == ['Aurelia', 'Salpa', 'Velella']
+
+
+def test_app_name_codes_missing_name():
+    names = {}
+    codes = _cli_app_name_codes(
+        names, pd.Series(['Aurelia', np.nan, None, np.nan], dtype=object))
+
+    # Missing names share a single code
+    assert codes == [0, 1, 1, 1]
+    assert json.loads(json.dumps(list(names), allow_nan=False)) == ['Aurelia', '']
+
+
+def test_analyse_logs_of_same_voyage(tmp_path, monkeypatch):
+    # Two logs of the same vessel and years, analysed at the same time
+    imma_dir = tmp_path / 'imma'
+    dwca_dir = tmp_path / 'dwca'
+    imma_dir.mkdir()
+    dwca_dir.mkdir()
+    write_log(imma_dir / 'Resolution_W1_1772-4.imma', '1772-07-13', '1774-03-01')
+    write_log(imma_dir / 'Resolution_W2_1772-4.imma', '1772-09-01', '1774-06-30')
+
+    monkeypatch.setattr(cli, 'IMMA_DIR', imma_dir)
+    monkeypatch.setattr(cli, 'DWCA_OUTPUT_DIR', dwca_dir)
+    monkeypatch.setattr(cli, 'GBIF', FakeGBIF)
+    monkeypatch.setattr(cli, 'Wikipedia', FakeWikipedia)
+    monkeypatch.setattr(cli, 'Occurrences', FakeOccurrences)
+
+    result = CliRunner().invoke(cli.cli, ['analyse', '--workers', '2'])
+
+    assert result.exit_code == 0
+    assert 'Total: 2' in result.output
+    assert (dwca_dir / 'Resolution_W1_1772-4.zip').read_text() == \
+        '1772-07-13 00:00:00 1774-03-01 00:00:00'
+    assert (dwca_dir / 'Resolution_W2_1772-4.zip').read_text() == \
+        '1772-09-01 00:00:00 1774-06-30 00:00:00'
+
+
+def test_parse_vessels_file_with_repeated_vessel():
+    vessels_file = io.StringIO(
+        '# Voyages\nDiscovery 1776-1777\n\nDiscovery 1901\nH.M.S. Alert 1875\n')
+
+    assert _cli_parse_vessels(('Triton',), '1882', vessels_file) == [
+        ('Triton', ['1882']),
+        ('Discovery', ['1776', '1777']),
+        ('Discovery', ['1901']),
+        ('H.M.S. Alert', ['1875']),
+    ]
+
+
+def test_app_binary_writes_shared_occurrences_once(tmp_path, monkeypatch):
+    # Two logs of the same voyage, which found the same occurrences
+    occurrences = pd.DataFrame({
+        'gbifID': [1, 2],
+        'eventDate': ['1772-08-01', '1773-01-01'],
+        'scientificName': ['Aurelia', None],
+        'decimalLatitude': [-1.0, -8.0],
+        'decimalLongitude': [1.0, 8.0],
+    })
+
+    routes = []
+    for stem in ['Resolution_W1_1772-4', 'Resolution_W2_1772-4']:
+        write_log(tmp_path / f'{stem}.imma', '1772-07-13', '1774-03-01')
+        DwCA(tmp_path / f'{stem}.zip').write(
+            [occurrences], list(occurrences.columns), title=stem)
+        routes.append((
+            'resolution',
+            IMMA(tmp_path / f'{stem}.imma').get_route(),
+            tmp_path / f'{stem}.zip',
+            tmp_path / f'{stem}.imma'
+        ))
+
+    monkeypatch.setattr(cli, 'APP_DATA_DIR', tmp_path / 'app')
+    monkeypatch.setattr(cli, '_cli_get_routes', lambda vessel_name: iter(routes))
+
+    cli._cli_app_binary(None, None)
+
+    with (tmp_path / 'app' / 'manifest.json').open() as f:
+        manifest = json.load(f)
+
+    assert [v['metadata']['count'] for v in manifest['voyages']] == [2, 0]
+    assert manifest['names'] == ['Aurelia', '']
+
+
+def test_analyse_only_changed_logs(tmp_path, monkeypatch):
+    imma_dir = tmp_path / 'imma'
+    dwca_dir = tmp_path / 'dwca'
+    imma_dir.mkdir()
+    dwca_dir.mkdir()
+    write_log(imma_dir / 'Resolution_W1_1772-4.imma', '1772-07-13', '1774-03-01')
+    write_log(imma_dir / 'Resolution_W2_1772-4.imma', '1772-09-01', '1774-06-30')
+
+    monkeypatch.setattr(cli, 'IMMA_DIR', imma_dir)
+    monkeypatch.setattr(cli, 'DWCA_OUTPUT_DIR', dwca_dir)
+    monkeypatch.setattr(cli, 'GBIF', FakeGBIF)
+    monkeypatch.setattr(cli, 'Wikipedia', FakeWikipedia)
+    monkeypatch.setattr(cli, 'Occurrences', FakeOccurrences)
+    monkeypatch.setattr(FakeGBIF, 'name_index_loads', 0)
+
+    CliRunner().invoke(cli.cli, ['analyse'])
+    assert FakeGBIF.name_index_loads == 1
+
+    # Nothing has changed, so the name index isn't needed
+    result = CliRunner().invoke(cli.cli, ['analyse'])
+    assert FakeGBIF.name_index_loads == 1
+    assert 'Total: 2' in result.output
+
+    # Only the changed log is analysed again, into its own output
+    write_log(imma_dir / 'Resolution_W1_1772-4.imma', '1772-08-01', '1774-03-01')
+    CliRunner().invoke(cli.cli, ['analyse'])
+    assert FakeGBIF.name_index_loads == 2
+    assert (dwca_dir / 'Resolution_W1_1772-4.zip').read_text() == \
+        '1772-08-01 00:00:00 1774-03-01 00:00:00'
+    assert (dwca_dir / 'Resolution_W2_1772-4.zip').read_text() == \
+        '1772-09-01 00:00:00 1774-06-30 00:00:00'
@@ -0,0 +1,53 @@
+import pytest
+
+from voyager.icoads import ICOADS
+
+
+def imma_record(year, month, day, lat, lon, ship_id, supd):
+    # Core attachment, followed by the supplemental attachment (99)
+    core = f'{year:4d}{month:2d}{day:2d}{"":4}{lat:5d}{lon:6d}{"":11}{ship_id:9s}'
+    return core.ljust(108) + '99 0 ' + supd
+
+
+@pytest.fixture
+def icoads(tmp_path, monkeypatch):
+    icoads_dir = tmp_path / 'IMMA1_R3.1.0_COMBINED'
+    icoads_dir.mkdir()
+    (icoads_dir / 'IMMA1_R3.1.0_1870-01').write_text('\n'.join([
+        imma_record(1870, 1, 1, 5000, 100, 'ALERT', 'H.M.S. Alert'),
+        imma_record(1870, 1, 2, 5100, 200, 'ALERT', 'H.M.S. Alert'),
+        imma_record(1870, 1, 3, 5200, 300, 'TRITON', 'H.M.S. Triton'),
+        imma_record(1870, 1, 4, 5300, 400, 'ALERTNESS', 'HMS Alertness'),
+    ]) + '\n')
+    (icoads_dir / 'IMMA1_R3.1.0_1871-01').write_text(
+        imma_record(1871, 1, 5, 5400, 500, 'ALERT', 'H.M.S. Alert') + '\n')
+
+    monkeypatch.setattr(ICOADS, 'ICOADS_DIR', icoads_dir)
+    monkeypatch.setattr(ICOADS, 'INDEX_DIR', tmp_path / 'index')
+    return ICOADS()
+
+
+def test_search_punctuated_vessel_name(icoads):
+    df = icoads.search('H.M.S. Alert', ['1870'])
+
+    assert list(df['ship_id']) == ['ALERT', 'ALERT']
+    assert list(df['day']) == [1, 2]
+    assert list(df['lat']) == [50.0, 51.0]
+
+
+def test_search_uses_cached_index(icoads):
+    icoads.search('Triton', ['1870'])
+    df = icoads.search('h\\.m\\.s\\. triton', ['1870'])
+
+    assert list(df['ship_id']) == ['TRITON']
+
+
+def test_search_vessel_in_different_years(icoads):
+    results = icoads.search_vessels([
+        ('Alert', ['1870']),
+        ('Alert', ['1871']),
+        ('Alert', ['1870', '1871']),
+    ])
+
+    assert [list(df['year']) for df in results] == [
+        [1870, 1870, 1870], [1871], [1870, 1870, 1870, 1871]]
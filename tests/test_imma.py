@@ -0,0 +1,49 @@
+import IMMA as imma_reader
+import numpy as np
+import pytest
+
+from voyager.config import IMMA_DIR
+from voyager.imma import IMMA
+
+# Logs with records with and without attachments, and supplemental data
+# (SUPD) after other attachments
+SAMPLE_LOGS = ['Isabella_1818.imma', 'Vincennes_1838-42.imma']
+
+
+@pytest.fixture(params=SAMPLE_LOGS)
+def sample_log(request):
+    file_path = IMMA_DIR / request.param
+    return file_path, list(imma_reader.get(str(file_path)))
+
+
+def test_decode_core_matches_pyimma(sample_log):
+    file_path, records = sample_log
+    core = IMMA.decode_core(file_path)
+
+    assert len(core) == len(records)
+
+    for field in ['YR', 'MO', 'DY', 'LAT', 'LON']:
+        expected = [np.nan if r[field] is None else r[field] for r in records]
+        np.testing.assert_allclose(core[field], expected)
+
+    assert list(core['ID']) == [
+        (r['ID'] or '').strip() or None for r in records]
+
+
+def test_get_supplemental_matches_pyimma(sample_log):
+    file_path, records = sample_log
+    core = IMMA.decode_core(file_path)
+
+    supd = IMMA.get_supplemental(file_path, core['offset'].values)
+
+    assert supd == [r.get('SUPD') for r in records]
+
+
+def test_decode_int():
+    chars = np.array([
+        [ord(c) for c in value]
+        for value in ['  123', ' -123', '    0', '     ', ' 12x3']
+    ])
+
+    np.testing.assert_array_equal(
+        IMMA._decode_int(chars), [123, -123, 0, np.nan, np.nan])
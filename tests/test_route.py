@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+from geopy.distance import geodesic
+
+from voyager.occurrences import Occurrences
+from voyager.route import Route
+
+
+def get_route(*stages):
+    # A route of daily (lat, lon) stages, each a (date from, lats, lons)
+    frames = []
+    for date_from, lats, lons in stages:
+        dates = pd.date_range(date_from, periods=len(lats))
+        frames.append(pd.DataFrame({
+            'year': dates.year,
+            'month': dates.month,
+            'day': dates.day,
+            'lat': lats,
+            'lon': lons,
+            'datetime': dates
+        }))
+
+    return Route(pd.concat(frames, ignore_index=True))
+
+
+def test_douglas_peucker():
+    # East along the equator, then north - with a small kink in each leg
+    x = np.array([0, 1, 2, 3, 4, 4, 4.01, 4, 4])
+    y = np.array([0, 0.01, 0, 0, 0, 1, 2, 3, 4])
+
+    keep = Route._douglas_peucker(x, y, tolerance=0.05)
+
+    assert list(np.flatnonzero(keep)) == [0, 4, 8]
+
+
+def test_simplified_route_keeps_endpoints_and_stage_breaks():
+    # Two stages along the same line, with a gap too long to interpolate
+    # between - without the break, the stages' ends would be dropped
+    route = get_route(
+        ('1800-01-01', np.zeros(30), np.linspace(10, 13, 30)),
+        ('1800-04-01', np.zeros(30), np.linspace(20, 23, 30)),
+    )
+
+    full = route.get_coordinates()
+    simplified = route.get_coordinates(tolerance=0.05)
+
+    stage_ends = full.index[[0, 29, 30, 59]]
+    assert list(simplified.index) == list(stage_ends)
+    assert simplified.equals(full.loc[stage_ends])
+
+
+def test_bounding_boxes_contain_route_distance():
+    # Pole to pole, across the antimeridian
+    days = 60
+    route = get_route((
+        '1800-01-01',
+        np.linspace(-75, 85, days),
+        (np.linspace(170, 200, days) + 180) % 360 - 180
+    ))
+
+    km = Occurrences.MAX_KM_TO_ROUTE
+    random = np.random.RandomState(0)
+    dates = route.interpolated.index.repeat(50)
+    locations = route.get_locations_by_dates(dates)
+
+    # Mostly near the edge of the boxes
+    points = [
+        geodesic(kilometers=distance).destination(location, bearing)
+        for location, distance, bearing in zip(
+            locations,
+            random.uniform(km * 0.9, km * 1.1, len(dates)),
+            random.uniform(0, 360, len(dates)))
+    ]
+    latitudes = np.array([p.latitude for p in points])
+    longitudes = np.array([p.longitude for p in points])
+
+    in_bounding_boxes = route.in_bounding_boxes(
+        dates, latitudes, longitudes, km)
+
+    within_km = np.array([
+        geodesic(location, (lat, lon)).kilometers <= km
+        for location, lat, lon in zip(locations, latitudes, longitudes)
+    ])
+
+    assert within_km.any() and not within_km.all()
+    assert in_bounding_boxes[within_km].all()
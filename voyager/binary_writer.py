@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class BinaryWriter():
+
+    # Writes data frame columns to a file as contiguous little-endian arrays,
+    # which the app can read straight into JavaScript typed arrays, e.g.
+    # new Float32Array(buffer, column.offset, length)
+
+    types = {
+        'float32': 'Float32',
+        'float64': 'Float64',
+        'int32': 'Int32',
+        'uint16': 'Uint16',
+        'uint32': 'Uint32',
+    }
+
+    # Typed array offsets must be a multiple of their element size
+    alignment = 8
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._f = file_path.open('wb')
+        self._offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, df, dtypes):
+        # Write the columns in dtypes, and return their layout in the file
+        columns = {}
+        for column, dtype in dtypes.items():
+            values = np.asarray(
+                df[column], dtype=np.dtype(dtype).newbyteorder('<'))
+
+            self._pad()
+            columns[column] = {
+                'type': self.types[dtype],
+                'offset': self._offset
+            }
+            self._f.write(values.tobytes())
+            self._offset += values.nbytes
+
+        return {
+            'length': len(df),
+            'columns': columns
+        }
+
+    def close(self):
+        self._f.close()
+
+    def _pad(self):
+        padding = -self._offset % self.alignment
+        self._f.write(b'\0' * padding)
+        self._offset += padding
@@ -9,6 +9,9 @@ import requests_cache
 from pathlib import Path
 from bs4 import BeautifulSoup
 import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import json
 from operator import attrgetter
@@ -24,6 +27,9 @@ from voyager.utils import years_to_range, extract_surname
 from voyager.imma import IMMA
 from voyager.wikipedia import Wikipedia
 from voyager.route import Route
+from voyager.manifest import Manifest
+from voyager.dwca import DwCA
+from voyager.binary_writer import BinaryWriter
 
 from voyager.config import logger, CACHE_DIR, IMMA_DIR, APP_DATA_DIR, DWCA_OUTPUT_DIR, OUTPUT_DIR
 
@@ -31,6 +37,32 @@ requests_cache.install_cache(str(CACHE_DIR / 'requests_cache'))
 
 re_vessel = re.compile(r'(?P<vessel>[a-zA-Z_\+]+)_[0-9]')
 
+# Day zero of the day offsets in the app's binary data - before any voyage
+APP_EPOCH = pd.Timestamp('1680-01-01')
+
+# Typed arrays for the app's binary data
+APP_COORDINATE_TYPES = {
+    'lon': 'float32',
+    'lat': 'float32',
+    'day': 'uint32'
+}
+
+# Tolerances (in degrees) of the simplified routes in the app's binary
+# data, for drawing the routes zoomed out
+APP_ROUTE_TOLERANCES = [0.05, 0.25]
+
+APP_OCCURRENCE_TYPES = {
+    'day': 'uint32',
+    # gbifIDs are too big for 32 bits
+    'id': 'float64',
+    'name': 'uint32',
+    'lat': 'float32',
+    'lon': 'float32'
+}
+
+# GBIF & Wikipedia data used by analyse, in this process
+_cli_analyse_context = {}
+
 
 @click.group()
 @click.version_option()
@@ -42,11 +74,17 @@ def cli():
 @click_log.simple_verbosity_option(logger)
 @click.option('-l', '--limit', type=int)
 @click.option('-n', '--vessel-name')
-def app(limit, vessel_name):
+@click.option('--format', 'output_format', type=click.Choice(['js', 'binary']), default='js', help='Export javascript source files, or binary typed arrays with a JSON manifest')
+@click.option('--chunk-years', type=int, help='Split each voyage into chunks of this many years (binary format only)')
+def app(limit, vessel_name, output_format, chunk_years):
 
-    imma_files = _cli_imma_files(vessel_name)
+    if output_format == 'binary':
+        _cli_app_binary(limit, vessel_name, chunk_years)
+        return
+    elif chunk_years:
+        raise click.UsageError('--chunk-years requires --format binary')
 
-    counter = 0
+    imma_files = _cli_imma_files(vessel_name)
 
     js_voyages_file = APP_DATA_DIR / 'voyages.js'
     js_metadata_file = APP_DATA_DIR / 'metadata.js'
@@ -60,6 +98,7 @@ def app(limit, vessel_name):
     }
 
     new_line = False
+    new_occurrences_line = False
 
     logger.info(
         f'Exporting to {js_voyages_file}')
@@ -76,12 +115,22 @@ def app(limit, vessel_name):
 
     occurrence_count = 0
 
-    with js_voyages_file.open('w') as f:
+    # Both files are written a voyage at a time, so only one voyage's
+    # records are held in memory
+    with js_voyages_file.open('w') as f, js_occurrences_file.open('w') as occurrences_f:
         f.write('export default [\n')
+        occurrences_f.write('export default {')
+
+        # Occurrences are keyed by vessel, so a vessel's last voyage
+        # replaces any before it - only write the last. The voyages are
+        # found from the file names, so the routes can still be parsed
+        # one at a time
+        voyages = list(itertools.islice(_cli_get_voyages(vessel_name), limit))
+        last_voyages = {vessel: i for i, (vessel, *_) in enumerate(voyages)}
 
-        occurence_records = {}
+        for i, (vessel, imma_file, dwca_file) in enumerate(voyages):
 
-        for vessel, route, dwca in _cli_get_routes(vessel_name):
+            route = IMMA(imma_file).get_route()
 
             logger.info(
                 f'Exporting {vessel} {route.year_from} - {route.year_to}')
@@ -91,31 +140,19 @@ def app(limit, vessel_name):
 
             coordinates = route.get_coordinates()
 
-            df = dwca.copy()
-
-            df['datetime'] = pd.to_datetime(
-                df['eventDate'], infer_datetime_format=True)
-
-            df['timestamp'] = df.datetime.astype('int64') // 10**9
-
-            df.rename(columns={
-                'gbifID': 'id',
-                'scientificName': 'name',
-                'decimalLatitude': 'lat',
-                'decimalLongitude': 'lon',
-            }, inplace=True)
-
-            # Ensure the occurrences occur only within the published time frame
-            df = df[(df['datetime'] > route.date_from) & (
-                df['datetime'] <= route.date_to)]
-
+            df = _cli_app_occurrences(route, dwca_file)
             df = df[['timestamp', 'id', 'name', 'lat', 'lon']]
-
-            df = df.sort_values(by=['timestamp'])
             df['timestamp'] = df['timestamp'].astype(str)
 
             occurrence_count += df.shape[0]
-            occurence_records[vessel] = df.values.tolist()
+
+            if last_voyages[vessel] == i:
+                if new_occurrences_line:
+                    occurrences_f.write(',')
+
+                occurrences_f.write(f'\n{json.dumps(vessel)}: ')
+                occurrences_f.write(df.to_json(orient='values'))
+                new_occurrences_line = True
 
             _update_map_metadata(coordinates)
 
@@ -135,16 +172,10 @@ def app(limit, vessel_name):
             f.write(json.dumps(voyage))
             new_line = True
 
-            counter += 1
-
-            if limit and counter >= limit:
-                break
-
         f.write('\n]')
+        occurrences_f.write('\n}\n')
 
-    # Give the map tiles time to load before rendering any lines
-    dt = datetime.fromtimestamp(map_metadata['timestamp']['min'])
-    timestamp_min = datetime.timestamp(dt + relativedelta(months=-24))
+    timestamp_min = _cli_app_min_timestamp(map_metadata['timestamp']['min'])
 
     # Output the metadata file
     with js_metadata_file.open('w') as f:
@@ -153,162 +184,513 @@ def app(limit, vessel_name):
         f.write(f"\tmaxTimestamp: {map_metadata['timestamp']['max']}")
         f.write('\n}')
 
-    with js_occurrences_file.open('w') as f:
-        f.write('export default \n')
-        f.write(json.dumps(occurence_records))
-        f.write('\n')
+    click.secho(f'Occurrence count: {occurrence_count}', fg='green')
+
+
+def _cli_app_binary(limit, vessel_name, chunk_years=None):
+    # Export the voyages and occurrences as typed arrays, with coordinates
+    # quantised to Float32, dates to days since APP_EPOCH, and the names
+    # dictionary encoded. Each voyage is written to its own .bin files - or
+    # one per chunk_years window - so the app only needs to fetch the
+    # voyages and time windows it's showing. Each route is also simplified
+    # at APP_ROUTE_TOLERANCES. manifest.json indexes the chunks, with their
+    # time range and the layout of their arrays
+
+    manifest_file = APP_DATA_DIR / 'manifest.json'
+    voyages_dir = APP_DATA_DIR / 'voyages'
+    voyages_dir.mkdir(parents=True, exist_ok=True)
+
+    # Remove chunks from any previous export
+    for f in voyages_dir.glob('*.bin'):
+        f.unlink()
+
+    logger.info(f'Exporting to {manifest_file}')
+
+    voyages = []
+    names = {}
+    # Occurrence IDs written for each vessel
+    occurrence_ids = {}
+    timestamp_min = timestamp_max = None
+
+    for vessel, route, dwca_file, imma_file in itertools.islice(_cli_get_routes(vessel_name), limit):
+
+        logger.info(
+            f'Exporting {vessel} {route.year_from} - {route.year_to}')
+
+        # Full resolution, followed by the simplified routes
+        routes = [route.get_coordinates()] + [
+            route.get_coordinates(tolerance=tolerance)
+            for tolerance in APP_ROUTE_TOLERANCES
+        ]
+        for coordinates in routes:
+            coordinates['day'] = _cli_app_days(coordinates['timestamp'])
+
+        coordinates = routes[0]
+
+        # Logs of the same voyage (e.g. Resolution_W1 and Resolution_W2)
+        # find the same occurrences - only write each one once per vessel,
+        # with its first voyage, so the app doesn't draw it twice
+        vessel_ids = occurrence_ids.setdefault(vessel, set())
+        df = _cli_app_occurrences(route, dwca_file)
+        df = df[~df['id'].isin(vessel_ids)].copy()
+        vessel_ids.update(df['id'])
+
+        df['day'] = _cli_app_days(df['timestamp'])
+        df['name'] = _cli_app_name_codes(names, df['name'])
+
+        if timestamp_min is None or coordinates.timestamp.min() < timestamp_min:
+            timestamp_min = coordinates.timestamp.min()
+
+        if timestamp_max is None or coordinates.timestamp.max() > timestamp_max:
+            timestamp_max = coordinates.timestamp.max()
+
+        # Named after the IMMA file, like the voyage's DwC-A file
+        chunks = []
+        for window, chunk_routes, chunk_df in _cli_app_chunks(routes, df, chunk_years):
+            file_name = imma_file.stem
+            if window is not None:
+                file_name += f'-{window}'
+
+            with BinaryWriter(voyages_dir / f'{file_name}.bin') as writer:
+                chunk = {
+                    'file': f'{voyages_dir.name}/{file_name}.bin',
+                    'coordinates': writer.write(chunk_routes[0], APP_COORDINATE_TYPES),
+                    'simplified': [
+                        dict(writer.write(coordinates, APP_COORDINATE_TYPES),
+                             tolerance=tolerance)
+                        for tolerance, coordinates in zip(APP_ROUTE_TOLERANCES, chunk_routes[1:])
+                    ],
+                    'occurrences': writer.write(chunk_df, APP_OCCURRENCE_TYPES)
+                }
 
+            if window is not None:
+                chunk['minTimestamp'] = _cli_app_year_timestamp(window)
+                chunk['maxTimestamp'] = _cli_app_year_timestamp(
+                    window + chunk_years)
+            else:
+                chunk['minTimestamp'] = int(coordinates.timestamp.min())
+                chunk['maxTimestamp'] = int(coordinates.timestamp.max())
+
+            chunks.append(chunk)
+
+        voyages.append({
+            'metadata': {
+                'vessel': vessel,
+                'year_from': route.year_from,
+                'year_to': route.year_to,
+                'count': df.shape[0]
+            },
+            'chunks': chunks
+        })
+
+    if not voyages:
+        logger.error('No voyages found to export')
+        return
+
+    with manifest_file.open('w') as f:
+        json.dump({
+            'epoch': int(APP_EPOCH.timestamp()),
+            'minTimestamp': _cli_app_min_timestamp(timestamp_min),
+            'maxTimestamp': int(timestamp_max),
+            'names': list(names),
+            'voyages': voyages
+        }, f)
+
+    occurrence_count = sum(v['metadata']['count'] for v in voyages)
     click.secho(f'Occurrence count: {occurrence_count}', fg='green')
 
 
+def _cli_app_name_codes(names, values):
+    # Dictionary encode the names, adding any new ones to names. Missing
+    # names are encoded as "" - NaN never equals itself, so would be added
+    # again for each occurrence, and isn't valid JSON
+    return [names.setdefault(name, len(names)) for name in values.fillna('')]
+
+
+def _cli_app_chunks(routes, df, chunk_years=None):
+    # Split a voyage's routes (at each resolution) and occurrences into
+    # (window start year, routes, occurrences) chunks of chunk_years. Each
+    # chunk's routes run on to the first point of the next, so the lines
+    # have no gaps between chunks
+    if not chunk_years:
+        yield None, routes, df
+        return
+
+    route_windows = [
+        _cli_app_windows(coordinates['timestamp'], chunk_years)
+        for coordinates in routes
+    ]
+    occurrence_windows = _cli_app_windows(df['timestamp'], chunk_years)
+
+    for window in np.union1d(route_windows[0], occurrence_windows):
+        chunk_routes = []
+        for coordinates, coordinate_windows in zip(routes, route_windows):
+            rows = np.flatnonzero(coordinate_windows == window)
+            if len(rows):
+                chunk_routes.append(coordinates.iloc[rows[0]:rows[-1] + 2])
+            else:
+                chunk_routes.append(coordinates.iloc[:0])
+
+        yield int(window), chunk_routes, df[occurrence_windows == window]
+
+
+def _cli_app_windows(timestamps, chunk_years):
+    years = pd.to_datetime(timestamps, unit='s').dt.year.values
+    return years // chunk_years * chunk_years
+
+
+def _cli_app_year_timestamp(year):
+    return int(pd.Timestamp(year=year, month=1, day=1).timestamp())
+
+
+def _cli_app_occurrences(route, dwca_file):
+    df = DwCA(dwca_file).read(columns=[
+        'eventDate',
+        'gbifID',
+        'scientificName',
+        'decimalLatitude',
+        'decimalLongitude'
+    ])
+
+    df['datetime'] = pd.to_datetime(
+        df['eventDate'], infer_datetime_format=True)
+
+    df['timestamp'] = df.datetime.astype('int64') // 10**9
+
+    df.rename(columns={
+        'gbifID': 'id',
+        'scientificName': 'name',
+        'decimalLatitude': 'lat',
+        'decimalLongitude': 'lon',
+    }, inplace=True)
+
+    # Ensure the occurrences occur only within the published time frame
+    df = df[(df['datetime'] > route.date_from) & (
+        df['datetime'] <= route.date_to)]
+
+    return df.sort_values(by=['timestamp'])
+
+
+def _cli_app_days(timestamps):
+    # Whole days since APP_EPOCH
+    return (timestamps - APP_EPOCH.timestamp()) // 86400
+
+
+def _cli_app_min_timestamp(timestamp):
+    # Give the map tiles time to load before rendering any lines
+    dt = datetime.fromtimestamp(timestamp)
+    return datetime.timestamp(dt + relativedelta(months=-24))
+
+
 @ cli.command()
 @ click_log.simple_verbosity_option(logger)
 @ click.option('-l', '--limit', type=int)
 @ click.option('-f', '--file-name')
 @ click.option('-n', '--vessel-name')
-def analyse(limit, file_name, vessel_name):
+@ click.option('-w', '--workers', type=int, default=1, help='Number of voyages to analyse in parallel')
+@ click.option('--force', is_flag=True, help='Analyse voyages even if their inputs are unchanged')
+def analyse(limit, file_name, vessel_name, workers, force):
 
     if file_name:
         imma_files = [IMMA_DIR / file_name]
     else:
         imma_files = _cli_glob_files(IMMA_DIR, '*.imma', limit)
 
+    # If vessel parameter is specified
+    if vessel_name:
+        imma_files = [f for f in imma_files if _cli_imma_file_get_vessel(
+            f.stem) == vessel_name]
+
     gbif = GBIF()
-    wikipedia = Wikipedia()
+
+    # Skip voyages whose inputs haven't changed since they were last analysed
+    manifest = Manifest(DWCA_OUTPUT_DIR / 'manifest.json')
+    inputs = {f.name: _cli_analyse_inputs(f, gbif) for f in imma_files}
+
+    if not force:
+        imma_files = [f for f in imma_files if not _cli_is_analysed(
+            manifest, f.name, inputs[f.name])]
+
+        logger.info('%s voyages unchanged since last analysed',
+                    len(inputs) - len(imma_files))
+
+    if imma_files:
+        # Load the name index up front, in this process - the workers
+        # share it rather than each loading their own
+        gbif.get_name_index()
+
+        wikipedia = Wikipedia()
+
+        if workers > 1:
+            # Forked workers share the loaded name index copy-on-write.
+            # Where fork isn't available, it's pickled to each worker
+            if 'fork' in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context('fork')
+            else:
+                mp_context = None
+
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=mp_context,
+                initializer=_cli_init_analyse,
+                initargs=(wikipedia, gbif)
+            ) as executor:
+                results = list(executor.map(_cli_analyse_voyage, imma_files))
+        else:
+            _cli_init_analyse(wikipedia, gbif)
+            results = map(_cli_analyse_voyage, imma_files)
+
+        for imma_file, result in zip(imma_files, results):
+            if result is None:
+                # Failed - make sure it's analysed again next time
+                manifest.remove(imma_file.name)
+            else:
+                manifest.update(
+                    imma_file.name, inputs[imma_file.name], **result)
+
+            manifest.save()
 
     total = 0
 
     error_totals = {}
 
-    for imma_file in imma_files:
-        vessel = _cli_imma_file_get_vessel(imma_file.stem)
-
-        # If vessel parameter is specified
-        if vessel_name and vessel_name != vessel:
+    for name in inputs:
+        entry = manifest.get(name)
+        if not entry or not entry['stats']:
             continue
 
-        imma = IMMA(imma_file)
-        route = imma.get_route()
+        occurrence_stats = entry['stats']
 
-        if route.year_to >= 1900:
-            continue
-        # At this point we have vessel name, and years so try and get extra metadata
-        wikipedia_voyage = wikipedia.find_voyage(
-            vessel, route.year_from, route.year_to)
+        for error, count in occurrence_stats['errors'].items():
+            error_totals.setdefault(error, 0)
+            error_totals[error] += count
 
-        if wikipedia_voyage:
-            collectors = [extract_surname(c)
-                          for c in wikipedia_voyage['collectors'].tolist()]
-        else:
-            collectors = []
+        total += occurrence_stats['total']
 
-        expedition = None
+    click.secho(f'Total: {total}', fg='green')
 
-        if vessel == 'first_fleet':
-            expedition = 'first fleet'
-            vessel = 'supply+sirius'
+    for error, error_total in error_totals.items():
+        click.secho(f'{error}: {error_total}', fg='green')
 
-        try:
-            occurrences = Occurrences(
-                route, gbif, vessel=vessel, collectors=collectors, expedition=expedition
-            )
 
-            dwca_file = f'{vessel}-{route.year_from}-{route.year_to}.csv'
+def _cli_init_analyse(wikipedia, gbif):
+    _cli_analyse_context['wikipedia'] = wikipedia
+    _cli_analyse_context['gbif'] = gbif
 
-            occurrences.to_dwca(DWCA_OUTPUT_DIR / dwca_file)
 
-            occurrence_stats = occurrences.get_stats()
+def _cli_analyse_inputs(imma_file, gbif):
+    # Everything a voyage's analysis depends on
+    return {
+        'imma': Manifest.hash_file(imma_file),
+        'dwca_file': _cli_dwca_file_name(imma_file),
+        'gbif': gbif.get_version(),
+        'max_km_to_route': Occurrences.MAX_KM_TO_ROUTE,
+        'interpolation_max_days': Route.INTERPOLATION_MAX_DAYS,
+        'interpolation_max_distance': Route.INTERPOLATION_MAX_DISTANCE,
+    }
 
-            for error, count in occurrence_stats['errors'].items():
-                error_totals.setdefault(error, 0)
-                error_totals[error] += count
 
-            total += occurrence_stats['total']
+def _cli_is_analysed(manifest, name, inputs):
+    if not manifest.is_current(name, inputs):
+        return False
 
-        except:
-            continue
+    # Make sure the output hasn't been deleted
+    dwca_file = manifest.get(name)['dwca_file']
+    return not dwca_file or (DWCA_OUTPUT_DIR / dwca_file).is_file()
 
-    click.secho(f'Total: {total}', fg='green')
 
-    for error, error_total in error_totals.items():
-        click.secho(f'{error}: {error_total}', fg='green')
+def _cli_analyse_voyage(imma_file):
+    # Returns the DwC-A file name & stats for the manifest, or None on failure
+    gbif = _cli_analyse_context['gbif']
+    wikipedia = _cli_analyse_context['wikipedia']
+
+    vessel = _cli_imma_file_get_vessel(imma_file.stem)
+
+    imma = IMMA(imma_file)
+    route = imma.get_route()
+
+    if route.year_to >= 1900:
+        return {'dwca_file': None, 'stats': None}
+    # At this point we have vessel name, and years so try and get extra metadata
+    wikipedia_voyage = wikipedia.find_voyage(
+        vessel, route.year_from, route.year_to)
+
+    if wikipedia_voyage:
+        collectors = [extract_surname(c)
+                      for c in wikipedia_voyage['collectors'].tolist()]
+    else:
+        collectors = []
+
+    expedition = None
+
+    if vessel == 'first_fleet':
+        expedition = 'first fleet'
+        vessel = 'supply+sirius'
+
+    try:
+        occurrences = Occurrences(
+            route, gbif, vessel=vessel, collectors=collectors, expedition=expedition
+        )
+
+        dwca_file = _cli_dwca_file_name(imma_file)
+
+        if occurrences.df.empty:
+            return {'dwca_file': None, 'stats': None}
+
+        occurrences.to_dwca(DWCA_OUTPUT_DIR / dwca_file)
+
+        occurrence_stats = occurrences.get_stats()
+
+        return {
+            'dwca_file': dwca_file,
+            'stats': {
+                'errors': {e: int(c) for e, c in occurrence_stats['errors'].items()},
+                'total': int(occurrence_stats['total'])
+            }
+        }
+
+    except:
+        return
 
 
 @ cli.command()
-@ click.option('-n', '--vessel-name', required=True)
-@ click.option('-y', '--years', required=True)
-@ click.option('-l', '--limit')
+@ click.option('-y', '--years')
+@ click.option('-w', '--workers', type=int, default=1, help='Number of monthly files to index in parallel')
 @ click_log.simple_verbosity_option(logger)
-def icoads_search(vessel_name, years, limit):
-    # Search ICOADS data for a vessel
+def icoads_index(years, workers):
+    # Index the vessel names in the ICOADS data, so searches don't
+    # need to re-read the archive
 
     icoads = ICOADS()
 
-    years = _cli_parse_years(years)
-    result = icoads.search(vessel_name, years)
+    if years:
+        years = _cli_parse_years(years)
 
-    if not result.empty:
-        year_from = result['datetime'].min().year
-        year_to = result['datetime'].max().year
-        ship_ids = result['ship_id'].unique()
-        click.secho(
-            f"Log found for ID {ship_ids} - {result.shape[0]} entries {year_from}-{year_to}", fg='green')
-    else:
-        logger.error(f'No log records found for {vessel_name} {years}')
+    icoads.build_index(years, workers=workers)
 
 
 @ cli.command()
-@ click.option('-n', '--vessel-name')
-@ click.option('-y', '--years', required=True)
+@ click.option('-n', '--vessel-name', multiple=True)
+@ click.option('-y', '--years')
+@ click.option('-f', '--vessels-file', type=click.File(), help='File of vessel names and years, one "name years" per line')
+@ click.option('-l', '--limit')
+@ click.option('-w', '--workers', type=int, default=1, help='Number of monthly files to search in parallel')
 @ click_log.simple_verbosity_option(logger)
-def icoads_to_imma(vessel_name, years):
-    # Find a shape in ICOADS data, and save it to an individual IMMA file
+def icoads_search(vessel_name, years, vessels_file, limit, workers):
+    # Search ICOADS data for vessels
+
     icoads = ICOADS()
-    years = _cli_parse_years(years)
-    result = icoads.search(vessel_name, years)
 
-    if not result.empty:
+    vessels = _cli_parse_vessels(vessel_name, years, vessels_file)
+    results = icoads.search_vessels(vessels, workers=workers)
+
+    for (vessel_name, years), result in zip(vessels, results):
+        if not result.empty:
+            year_from = result['datetime'].min().year
+            year_to = result['datetime'].max().year
+            ship_ids = result['ship_id'].unique()
+            click.secho(
+                f"Log found for {vessel_name} ID {ship_ids} - {result.shape[0]} entries {year_from}-{year_to}", fg='green')
+        else:
+            logger.error(
+                f'No log records found for {vessel_name} {years}')
 
-        column_mappings = {
-            "year": "YR",
-            "month": "MO",
-            "day": "DY",
-            "lat": "LAT",
-            "lon": "LON"
-        }
 
-        year_str = '-'.join(years)
-        filepath = IMMA_DIR / f'{vessel_name}_{year_str}.imma'
+@ cli.command()
+@ click.option('-n', '--vessel-name', multiple=True)
+@ click.option('-y', '--years')
+@ click.option('-f', '--vessels-file', type=click.File(), help='File of vessel names and years, one "name years" per line')
+@ click.option('-w', '--workers', type=int, default=1, help='Number of monthly files to search in parallel')
+@ click_log.simple_verbosity_option(logger)
+def icoads_to_imma(vessel_name, years, vessels_file, workers):
+    # Find vessels in ICOADS data, and save each to an individual IMMA file
+    icoads = ICOADS()
 
-        result = result.rename(columns=column_mappings)
+    vessels = _cli_parse_vessels(vessel_name, years, vessels_file)
+    results = icoads.search_vessels(vessels, workers=workers)
 
-        # Imma file has required column
-        imma_required_cols = ()
-        attachments = range(0, 1)
-        for i in attachments:
-            imma_required_cols += imma_parameters[i]
+    for (vessel_name, years), result in zip(vessels, results):
+        if not result.empty:
+            _cli_write_imma(vessel_name, years, result)
+            click.secho(
+                f"Saved IMMA log for {vessel_name} - {result.shape[0]} entries", fg='green')
+        else:
+            logger.error(f'No log records found for {vessel_name} {years}')
 
-        with filepath.open("wb") as f:
-            for i, row in result[column_mappings.values()].iterrows():
-                record = {c: None for c in imma_required_cols}
-                # Attachments dictates the required fields for the IMMA file
-                record['attachments'] = list(attachments)
-                record['ID'] = vessel_name
 
-                record.update(row.to_dict())
-                imma_writer.write(record, f)
+def _cli_write_imma(vessel_name, years, result):
 
-        click.secho(
-            f"Saved IMMA log for {vessel_name} - {result.shape[0]} entries", fg='green')
+    column_mappings = {
+        "year": "YR",
+        "month": "MO",
+        "day": "DY",
+        "lat": "LAT",
+        "lon": "LON"
+    }
 
+    if len(years) > 1:
+        year_str = f'{years[0]}-{years[-1]}'
     else:
+        year_str = years[0]
+
+    filepath = IMMA_DIR / f'{vessel_name}_{year_str}.imma'
+
+    result = result.rename(columns=column_mappings)
+
+    # Imma file has required column
+    imma_required_cols = ()
+    attachments = range(0, 1)
+    for i in attachments:
+        imma_required_cols += imma_parameters[i]
+
+    with filepath.open("wb") as f:
+        for i, row in result[column_mappings.values()].iterrows():
+            record = {c: None for c in imma_required_cols}
+            # Attachments dictates the required fields for the IMMA file
+            record['attachments'] = list(attachments)
+            record['ID'] = vessel_name
+
+            record.update(row.to_dict())
+            imma_writer.write(record, f)
+
+
+def _cli_parse_vessels(vessel_names, years, vessels_file):
+    # List of (vessel name, years), from the --vessel-name options (all
+    # searched for in --years) and/or the vessels file. A vessel can be
+    # listed more than once, for different voyages
+    vessels = []
+
+    if vessel_names:
+        if not years:
+            raise click.UsageError('Please enter the years to search')
 
-        logger.error(f'No log records found for {vessel_name} {years}')
+        years = _cli_parse_years(years)
+        for vessel_name in vessel_names:
+            vessels.append((vessel_name, years))
+
+    if vessels_file:
+        for line in vessels_file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            try:
+                vessel_name, vessel_years = line.rsplit(None, 1)
+            except ValueError:
+                raise click.UsageError(
+                    f'Please enter vessel name and years, not "{line}"')
+
+            vessels.append((vessel_name, _cli_parse_years(vessel_years)))
+
+    if not vessels:
+        raise click.UsageError('Please enter a vessel name or vessels file')
+
+    return vessels
 
 
 def _cli_parse_years(years):
 
-    year_match = re.match(r'([0-9]{4})', years)
+    year_match = re.match(r'([0-9]{4})$', years)
     if year_match:
         return [year_match.group(1)]
 
@@ -320,11 +702,22 @@ def _cli_parse_years(years):
     except AttributeError:
         raise click.UsageError('Please enter year range as YYYY or YYYY-YYYY')
 
-    return years_to_range(year_from, year_to)
+    return [str(year) for year in years_to_range(year_from, year_to)]
 
 
 def _cli_get_routes(vessel_name=None):
 
+    for vessel, imma_file, dwca_file in _cli_get_voyages(vessel_name):
+        imma = IMMA(imma_file)
+        route = imma.get_route()
+
+        yield (vessel, route, dwca_file, imma_file)
+
+
+def _cli_get_voyages(vessel_name=None):
+    # The vessel, IMMA file and DwC-A file of each analysed voyage,
+    # without parsing the logs
+
     imma_files = _cli_imma_files()
     for imma_file in imma_files:
         vessel = _cli_imma_file_get_vessel(imma_file.stem)
@@ -333,19 +726,13 @@ def _cli_get_routes(vessel_name=None):
         if vessel_name and vessel_name != vessel:
             continue
 
-        imma = IMMA(imma_file)
-        route = imma.get_route()
-
-        dwca_file_name = _cli_dwca_file_name(vessel, route)
-
-        dwca_file = DWCA_OUTPUT_DIR / dwca_file_name
+        dwca_file = DWCA_OUTPUT_DIR / _cli_dwca_file_name(imma_file)
         if dwca_file.is_file():
-            dwca = pd.read_csv(dwca_file)
-            yield (vessel, route, dwca)
+            yield (vessel, imma_file, dwca_file)
 
 
 def _cli_dwca_files(limit=None):
-    for f in _cli_glob_files(IDWCA_OUTPUT_DIR, '*.csv', limit):
+    for f in _cli_glob_files(DWCA_OUTPUT_DIR, '*.zip', limit):
         yield f
 
 
@@ -367,8 +754,11 @@ def _cli_imma_file_get_vessel(file_name):
     return m.group('vessel').lower()
 
 
-def _cli_dwca_file_name(vessel, route):
-    return f'{vessel}-{route.year_from}-{route.year_to}.csv'
+def _cli_dwca_file_name(imma_file):
+    # Named after the IMMA file, as a vessel can have more than one log of
+    # the same voyage (e.g. Resolution_W1 and Resolution_W2), which would
+    # otherwise overwrite each other's output
+    return f'{imma_file.stem}.zip'
 
 
 def _cli_glob_files(dir_path, pattern, limit=None):
@@ -0,0 +1,96 @@
+import io
+import zipfile
+import pandas as pd
+from xml.sax.saxutils import escape, quoteattr
+
+
+class DwCA():
+
+    # Zipped Darwin Core Archive, with a single occurrence core file
+
+    core_file = 'occurrence.txt'
+
+    # Namespaces for the terms not in Darwin Core
+    gbif_terms = [
+        'gbifID',
+        'datasetKey',
+        'species',
+        'verbatimScientificName',
+        'elevation',
+        'elevationAccuracy',
+        'depth',
+        'depthAccuracy',
+        'taxonKey',
+        'speciesKey',
+        'lastInterpreted',
+        'mediaType',
+        'issue',
+    ]
+
+    dc_terms = [
+        'license',
+        'rightsHolder',
+    ]
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def write(self, chunks, columns, title):
+        # Write an iterable of data frames to the archive - the occurrences
+        # are streamed into the zip, so only one chunk is held at a time
+        with zipfile.ZipFile(self.file_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            core = archive.open(self.core_file, 'w')
+            with io.TextIOWrapper(core, encoding='utf-8', newline='') as f:
+                for i, df in enumerate(chunks):
+                    df.to_csv(f, sep='\t', columns=columns,
+                              header=not i, index=False)
+
+            archive.writestr('meta.xml', self._get_meta(columns))
+            archive.writestr('eml.xml', self._get_eml(title))
+
+    def read(self, columns=None):
+        # Only parse the columns we need
+        with zipfile.ZipFile(self.file_path) as archive:
+            with archive.open(self.core_file) as f:
+                return pd.read_csv(f, sep='\t', usecols=columns)
+
+    def _get_meta(self, columns):
+        fields = '\n'.join(
+            f'    <field index="{i}" term={quoteattr(self._get_term(c))}/>'
+            for i, c in enumerate(columns)
+        )
+
+        return f'''<?xml version="1.0" encoding="UTF-8"?>
+<archive xmlns="http://rs.tdwg.org/dwc/text/" metadata="eml.xml">
+  <core encoding="UTF-8" fieldsTerminatedBy="\\t" linesTerminatedBy="\\n" fieldsEnclosedBy="&quot;" ignoreHeaderLines="1" rowType="http://rs.tdwg.org/dwc/terms/Occurrence">
+    <files>
+      <location>{self.core_file}</location>
+    </files>
+    <id index="{columns.index('gbifID')}"/>
+{fields}
+  </core>
+</archive>
+'''
+
+    @staticmethod
+    def _get_eml(title):
+        return f'''<?xml version="1.0" encoding="UTF-8"?>
+<eml:eml xmlns:eml="eml://ecoinformatics.org/eml-2.1.1" packageId="voyager" system="http://gbif.org" scope="system" xml:lang="en">
+  <dataset>
+    <title>{escape(title)}</title>
+    <creator>
+      <organizationName>Voyager</organizationName>
+    </creator>
+    <abstract>
+      <para>GBIF occurrences matched against historical ships log data, with missing collection dates and coordinates inferred from the route.</para>
+    </abstract>
+  </dataset>
+</eml:eml>
+'''
+
+    def _get_term(self, column):
+        if column in self.gbif_terms:
+            return f'http://rs.gbif.org/terms/1.0/{column}'
+        elif column in self.dc_terms:
+            return f'http://purl.org/dc/terms/{column}'
+        return f'http://rs.tdwg.org/dwc/terms/{column}'
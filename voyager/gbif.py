@@ -1,17 +1,30 @@
 
 
-from datetime import datetime
+import shutil
+import uuid
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import json
+import re
+from functools import lru_cache
 
 
 from voyager.config import INPUT_DIR, OUTPUT_DIR, CACHE_DIR, logger
+from voyager.name_index import NameIndex
+
+re_dynamic_properties = re.compile(
+    r'vessel|ship|expedition|cruise', re.IGNORECASE)
 
 
 class GBIF():
 
     GBIF_DWCA = INPUT_DIR / 'GBIF/1750-1901-dwca'
 
+    # Number of occurrence.txt rows parsed at a time
+    CHUNK_SIZE = 500000
+
     columns = [
         'gbifID',
         'datasetKey',
@@ -63,116 +76,263 @@ class GBIF():
         'issue',
     ]
 
+    # Types the parsed occurrences are cached with, so they do not need
+    # to be re-inferred every time the cache is loaded
+    dtypes = {
+        'gbifID': 'int64',
+        'decimalLatitude': 'float64',
+        'decimalLongitude': 'float64',
+        'year': 'float64',
+        'month': 'float64',
+        'day': 'float64',
+    }
+
+    # Low cardinality string columns, loaded as categoricals
+    categorical_columns = [
+        'datasetKey',
+        'kingdom',
+        'phylum',
+        'class',
+        'order',
+        'taxonRank',
+        'countryCode',
+        'occurrenceStatus',
+        'basisOfRecord',
+        'institutionCode',
+        'collectionCode',
+        'license',
+        'establishmentMeans',
+        'mediaType',
+    ]
+
     def __init__(self):
-        # To speeds things up DWCA file will only get populated when
-        # A cached file is not found
-        self.dwca = None
+        # Parsed occurrences are stored once, partitioned by year, so
+        # a year range only needs to read the partitions it covers
+        self.dataset_path = CACHE_DIR / 'gbif'
+        self.name_index_path = CACHE_DIR / 'gbif-name-index.parquet'
+        self.name_tokens_path = CACHE_DIR / 'gbif-name-tokens.parquet'
+        self.version_path = CACHE_DIR / 'gbif-version.txt'
+        self._name_index = None
+
+    def get_years(self, year_from, year_to):
+        self._build_dataset()
 
-    def get_cached(self, func, **kwargs):
-        cache_key = 'gbif'
+        logger.info(f'Loading GBIF {year_from} - {year_to} from cache')
 
-        if kwargs:
-            kwargs_key = '-'.join(map(str, kwargs.values()))
-            cache_key = f'{cache_key}-{kwargs_key}'
+        table = self._get_dataset().to_table(
+            filter=(ds.field('year') >= int(year_from))
+            & (ds.field('year') <= int(year_to))
+        )
 
-        cache_path = CACHE_DIR / f'{cache_key}.csv'
+        df = table.to_pandas()
+        df['year'] = df['year'].astype(self.dtypes['year'])
 
-        try:
-            logger.info(f'Loading {cache_key} from cache')
-            df = pd.read_csv(
-                cache_path
+        for column in self.categorical_columns:
+            if column in df:
+                df[column] = df[column].astype('category')
+
+        return df
+
+    def get_version(self):
+        # Identifies the build of the cached dataset, changing whenever
+        # the DWCA is re-parsed
+        self._build_dataset()
+
+        if not self.version_path.is_file():
+            self.version_path.write_text(uuid.uuid4().hex)
+
+        return self.version_path.read_text()
+
+    def get_name_index(self):
+        # Index of names in recordedBy, vessel and expedition - loaded
+        # once, and shared by every voyage using this instance
+        if self._name_index is None:
+            if not self.name_index_path.is_file():
+                logger.info('Cached GBIF name index not found - building')
+                self._build_name_index()
+
+            # Read straight into numpy arrays - only the vocabulary
+            # of distinct tokens are strings
+            index = pq.read_table(self.name_index_path)
+            tokens = pq.read_table(self.name_tokens_path).to_pandas()
+
+            self._name_index = NameIndex(
+                {
+                    field: field_tokens['token'].values
+                    for field, field_tokens in tokens.groupby('field', sort=False)
+                },
+                index.column('field_code').to_numpy(),
+                index.column('token_code').to_numpy(),
+                index.column('gbifID').to_numpy()
             )
-        except FileNotFoundError:
-            logger.info(f'Cached {cache_key} not found')
-
-            # If we haven't yet loaded the main GBIF file, load it now
-            # But only if kwargs are specified to prevent infinite loop
-            if self.dwca is None and kwargs:
-                logger.info(f'Loading DWCA')
-                self.dwca = self.get_cached(
-                    self.parse_dwca,
-                )
-
-            df = func(**kwargs)
-            df.to_csv(cache_path)
-        finally:
-            return df
 
-    def get_years(self, year_from, year_to):
-        return self.get_cached(
-            self._get_years,
-            year_from=year_from,
-            year_to=year_to
+        return self._name_index
+
+    def _build_name_index(self):
+        self._build_dataset()
+        dataset = self._get_dataset()
+
+        vocabularies = []
+        frames = []
+        for field in NameIndex.fields:
+            df = dataset.to_table(columns=['gbifID', field]).to_pandas()
+            vocabulary, rows = NameIndex.encode_tokens(df, field)
+
+            vocabularies.append(pd.DataFrame({
+                'field': field,
+                'token': vocabulary
+            }))
+            frames.append(rows)
+
+        # Tokens first, so the index is never there without them
+        pd.concat(vocabularies).to_parquet(
+            self.name_tokens_path, index=False)
+        pd.concat(frames).to_parquet(self.name_index_path, index=False)
+
+    def _build_dataset(self):
+        if not self.dataset_path.is_dir():
+            logger.info('Cached GBIF dataset not found - parsing DWCA')
+            self._write_dataset(self.parse_dwca())
+
+            # Any name index or version was from the previous dataset
+            for path in [self.name_index_path, self.name_tokens_path, self.version_path]:
+                if path.is_file():
+                    path.unlink()
+
+    def _get_dataset(self):
+        return ds.dataset(
+            str(self.dataset_path),
+            format='parquet',
+            partitioning=ds.partitioning(
+                pa.schema([('year', pa.int16())]), flavor='hive')
         )
 
-    def _get_years(self, year_from, year_to):
-        return self.dwca[(self.dwca['year'] >= year_from)
-                         & (self.dwca['year'] <= year_to)]
+    def _write_dataset(self, chunks):
+        # Write to a temporary directory first, so an interrupted parse
+        # does not leave a partial dataset behind
+        tmp_path = self.dataset_path.with_suffix('.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+        for df in chunks:
+            df = self._set_dtypes(df)
+
+            # Occurrences without a year can never match a year range
+            no_year = df['year'].isnull()
+            logger.info(f'Skipping {no_year.sum()} occurrences with no year')
+            df = df[~no_year].astype({'year': 'int16'})
+
+            pq.write_to_dataset(
+                pa.Table.from_pandas(
+                    df, schema=self._get_schema(df), preserve_index=False),
+                str(tmp_path),
+                partition_cols=['year']
+            )
+
+        tmp_path.rename(self.dataset_path)
+
+    def _get_schema(self, df):
+        # Every chunk must be written with the same schema, whatever types
+        # pandas happened to infer for that chunk
+        fields = []
+        for column in df.columns:
+            if column == 'year':
+                arrow_type = pa.int16()
+            elif column == 'datetime':
+                arrow_type = pa.timestamp('ns')
+            elif column in self.dtypes:
+                arrow_type = pa.from_numpy_dtype(self.dtypes[column])
+            else:
+                arrow_type = pa.string()
+            fields.append(pa.field(column, arrow_type))
+
+        return pa.schema(fields)
 
     def parse_dwca(self):
-        df = pd.read_csv(
+        # Only load the columns we use, a chunk at a time, so memory
+        # is bounded by CHUNK_SIZE rather than the size of the export
+        usecols = set(self.columns + ['dynamicProperties'])
+
+        chunks = pd.read_csv(
             self.GBIF_DWCA / 'occurrence.txt',
             sep='\t',
             error_bad_lines=False,
-            # usecols=self.columns,
-            # nrows=100000
+            usecols=lambda column: column in usecols,
+            dtype=str,
+            chunksize=self.CHUNK_SIZE
         )
 
-        def _dynamic_properties_get_vessel(row):
-            props_dict = self._parse_dynamic_properties(
-                row['dynamicProperties'])
-            return props_dict.get('vessel') or props_dict.get('ship')
-
-        def _dynamic_properties_get_expedition(row):
-            props_dict = self._parse_dynamic_properties(
-                row['dynamicProperties'])
-            return props_dict.get('expedition') or props_dict.get('cruise')
+        for i, df in enumerate(chunks):
+            logger.info(f'Parsing DWCA chunk {i}')
+            yield self._parse_chunk(df)
 
-        def _get_datetime(row):
-            try:
-                dt = datetime(year=int(row['year']),
-                              month=int(row['month']),
-                              day=int(row['day'])
-                              )
-            except ValueError:
-                return None
-            else:
-                return dt
-
-        df['vessel'] = None
-        df['expedition'] = None
-
-        df['vessel'] = df[df['dynamicProperties'].str.contains(
-            'vessel|ship', case=False, regex=True, na=False)].apply(lambda row: _dynamic_properties_get_vessel(row), axis=1)
-        df['expedition'] = df[df['dynamicProperties'].str.contains(
-            'expedition|cruise', case=False, regex=True, na=False)].apply(lambda row: _dynamic_properties_get_expedition(row), axis=1)
+    def _parse_chunk(self, df):
+        df['vessel'], df['expedition'] = self._extract_dynamic_properties(
+            df['dynamicProperties'])
 
         df['year'] = pd.to_numeric(df['year'], errors='coerce')
         df['month'] = pd.to_numeric(df['month'], errors='coerce')
         df['day'] = pd.to_numeric(df['day'], errors='coerce')
 
-        df['datetime'] = None
+        # Missing or invalid dates (e.g. 31 February) are coerced to NaT
+        df['datetime'] = pd.to_datetime(
+            df[['year', 'month', 'day']], errors='coerce')
 
-        date_mask = df['year'].notnull(
-        ) & df['month'].notnull() & df['day'].notnull()
+        return df
 
-        df['datetime'] = df[date_mask].apply(
-            lambda row: _get_datetime(row), axis=1)
+    def _set_dtypes(self, df):
+        for column, dtype in self.dtypes.items():
+            if column in df:
+                df[column] = pd.to_numeric(
+                    df[column], errors='coerce').astype(dtype)
 
         return df
 
+    def _extract_dynamic_properties(self, dynamic_props):
+        # Property strings repeat heavily within a dataset, so parse each
+        # distinct string once and map the results back onto the rows
+        unique_props = [
+            p for p in dynamic_props.dropna().unique()
+            if re_dynamic_properties.search(p)
+        ]
+
+        vessels = {}
+        expeditions = {}
+        for props in unique_props:
+            vessels[props], expeditions[props] = self._get_vessel_expedition(
+                props)
+
+        return dynamic_props.map(vessels), dynamic_props.map(expeditions)
+
+    @ staticmethod
+    @ lru_cache(maxsize=100000)
+    def _get_vessel_expedition(dynamic_props):
+        props_dict = GBIF._parse_dynamic_properties(dynamic_props)
+
+        vessel = props_dict.get('vessel') or props_dict.get('ship')
+        expedition = props_dict.get('expedition') or props_dict.get('cruise')
+
+        # JSON values are not always strings, but are stored as strings
+        return (
+            str(vessel) if vessel else None,
+            str(expedition) if expedition else None
+        )
+
     @ staticmethod
     def _parse_dynamic_properties(dynamic_props):
         props_dict = {}
 
-        try:
-            props_dict = json.loads(dynamic_props)
-        except json.JSONDecodeError:
+        # Only JSON objects are worth handing to the JSON parser
+        if dynamic_props.lstrip().startswith('{'):
             try:
-                exploded = dynamic_props.split(';')
-                exploded = [e.split(':') for e in exploded]
-                props_dict = {k.strip(): v.strip() for k, v in exploded}
-            except ValueError:
+                return json.loads(dynamic_props)
+            except json.JSONDecodeError:
                 pass
 
+        try:
+            exploded = dynamic_props.split(';')
+            exploded = [e.split(':') for e in exploded]
+            props_dict = {k.strip(): v.strip() for k, v in exploded}
+        except ValueError:
+            pass
+
         return props_dict
@@ -1,79 +1,185 @@
 import re
-import IMMA
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from voyager.config import INPUT_DIR, CACHE_DIR, IMMA_DIR,  logger
+from voyager.imma import IMMA
 
 
 class ICOADS():
 
     ICOADS_DIR = INPUT_DIR / 'IMMA1_R3.1.0_COMBINED'
 
-    def search(self, vessel_name, years):
-
-        df = self._parse_imma(vessel_name, years)
-        df['datetime'] = pd.to_datetime(
-            df['datetime'], infer_datetime_format=True)
+    # Per monthly file index of the records with a vessel name (SUPD)
+    INDEX_DIR = CACHE_DIR / 'icoads'
+
+    # SUPD is kept as is, so the vessel name regex matches exactly what it
+    # would against the records themselves
+    index_schema = pa.schema([
+        ('ship_id', pa.string()),
+        ('supd', pa.string()),
+        ('year', pa.int16()),
+        ('month', pa.int8()),
+        ('day', pa.int8()),
+        ('offset', pa.int64())
+    ])
+
+    columns = ['ship_id', 'year', 'month', 'day', 'lat', 'lon']
+
+    def search(self, vessel_name, years, workers=1):
+        return self.search_vessels([(vessel_name, years)], workers)[0]
+
+    def search_vessels(self, vessels, workers=1):
+        # Search for a list of (vessel name (regex), years), returning a
+        # result for each. Each monthly file is only read once, for all the
+        # vessels searched for in it. The same vessel can be searched for
+        # in different years, so the results are matched up by position
+        searches = {}
+        for i, (vessel_name, years) in enumerate(vessels):
+            for year in years:
+                for f in self._get_files(year):
+                    searches.setdefault(f, []).append((i, vessel_name))
+
+        files = sorted(searches)
+        dfs = self._map_files(
+            self._search_file, workers, files, [searches[f] for f in files])
+
+        dfs = [df for df in dfs if not df.empty]
+
+        if dfs:
+            df = pd.concat(dfs, ignore_index=True)
+        else:
+            df = pd.DataFrame(columns=self.columns + ['search'])
 
-        return df
+        results = []
+        for i in range(len(vessels)):
+            result = df[df['search'] == i].drop(
+                columns='search').reset_index(drop=True)
 
-    def _parse_imma(self, vessel_name, years):
+            result['datetime'] = pd.to_datetime(
+                result[['day', 'year', 'month']], errors='coerce')
 
-        cache_key = 'icoads_{0}_{1}'.format(
-            vessel_name,
-            '-'.join(years)
-        ).lower()
+            results.append(result.sort_values(by=['datetime']))
 
-        cache_path = CACHE_DIR / f'{cache_key}.csv'
+        return results
 
-        try:
-            logger.info(f'Loading {cache_key} from cache')
-            df = pd.read_csv(
-                cache_path
-            )
-        except FileNotFoundError:
-            logger.info(f'Cached {cache_key} not found - parsing data')
+    def build_index(self, years=None, workers=1):
+        # Index the whole archive (or just some years) up front
+        if years:
+            files = [f for year in years for f in self._get_files(year)]
         else:
-            return df
+            files = sorted(self.ICOADS_DIR.glob('IMMA1_R3.1.0_*'))
 
-        re_search = re.compile(vessel_name, re.IGNORECASE)
+        self._map_files(self._index_file, workers, files)
 
-        data = []
-        for year in years:
-            for record in self._read_imma(year):
-                supd = record.get('SUPD')
-                if not supd:
-                    continue
+    @staticmethod
+    def _map_files(func, workers, files, *args):
+        # The monthly files are independent, so can be read in parallel -
+        # func runs in the workers, so only its (small) result is returned
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(func, files, *args))
 
-                try:
-                    rid = record['ID'].strip()
-                except AttributeError:
-                    # No record ID??
-                    continue
+        return list(map(func, files, *args))
 
-                m = re_search.search(supd)
+    def _index_file(self, file_path):
+        self._get_index(file_path)
 
-                if m:
-                    data.append({
-                        'ship_id': rid,
-                        'year': record['YR'],
-                        'month': record['MO'],
-                        'day': record['DY'],
-                        'lat': record['LAT'],
-                        'lon': record['LON']
-                    })
+    def _search_file(self, file_path, searches):
+        # searches is a list of (search number, vessel name)
+        index = self._get_index(file_path)
 
-        df = pd.DataFrame(data)
+        # Far fewer distinct SUPD values than records
+        supds = index['supd'].unique()
 
-        df['datetime'] = pd.to_datetime(df[['day', 'year', 'month']])
-        df = df.sort_values(by=['datetime'])
+        matches = []
+        for i, vessel_name in searches:
+            re_search = re.compile(vessel_name, re.IGNORECASE)
+            matched = [v for v in supds if re_search.search(v)]
+            matches.append(
+                index[index['supd'].isin(matched)].assign(search=i))
 
-        df.to_csv(cache_path)
-        return df
+        df = pd.concat(matches, ignore_index=True)
+
+        if df.empty:
+            return pd.DataFrame(columns=self.columns + ['search'])
+
+        # Only read the matching lines for the coordinates - once, even
+        # if they match more than one vessel
+        offsets = df['offset'].unique()
+        records = IMMA.read_records(file_path, offsets)
+        records = pd.DataFrame({
+            'offset': offsets,
+            'lat': [r['LAT'] for r in records],
+            'lon': [r['LON'] for r in records],
+        })
+
+        df = df.merge(records, on='offset')
+        return df[self.columns + ['search']]
 
-    def _read_imma(self, year):
-        for f in self.ICOADS_DIR.glob(f'IMMA1_R3.1.0_{int(year)}-*'):
-            imma = IMMA.get(str(f))
+    def _get_index(self, file_path):
+        index_path = self.INDEX_DIR / f'{file_path.name}.parquet'
+
+        # Rebuild if the monthly file has changed since it was indexed
+        try:
+            if index_path.stat().st_mtime >= file_path.stat().st_mtime:
+                # Indexes cached before SUPD was kept are rebuilt
+                if pq.read_schema(index_path).names == self.index_schema.names:
+                    return pq.read_table(
+                        index_path, read_dictionary=['supd']).to_pandas()
+        except FileNotFoundError:
+            pass
+
+        logger.info(f'Indexing {file_path.name}')
+
+        df = self._build_index(file_path)
+
+        self.INDEX_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_suffix('.tmp')
+        pq.write_table(
+            pa.Table.from_pandas(df, schema=self.index_schema,
+                                 preserve_index=False),
+            tmp_path
+        )
+        tmp_path.replace(index_path)
+
+        return df
 
-            for record in imma:
-                yield record
+    def _build_index(self, file_path):
+        core = IMMA.decode_core(file_path)
+
+        # Only records with an ID, a date and attachments can match
+        core = core[
+            core['ID'].notnull() &
+            core[['YR', 'MO', 'DY']].notnull().all(axis=1) &
+            (core['length'] > IMMA.core_length)
+        ]
+
+        supd = pd.Series(
+            IMMA.get_supplemental(file_path, core['offset'].values),
+            index=core.index,
+            dtype=object
+        )
+        core = core[supd.notnull()]
+        supd = supd[supd.notnull()]
+
+        df = pd.DataFrame({
+            'ship_id': core['ID'],
+            'supd': supd,
+            'year': core['YR'],
+            'month': core['MO'],
+            'day': core['DY'],
+            'offset': core['offset']
+        }, columns=self.index_schema.names)
+
+        return df.astype({
+            'year': 'int16',
+            'month': 'int8',
+            'day': 'int8',
+            'offset': 'int64'
+        })
+
+    def _get_files(self, year):
+        return sorted(self.ICOADS_DIR.glob(f'IMMA1_R3.1.0_{int(year)}-*'))
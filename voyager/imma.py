@@ -1,5 +1,6 @@
 
 import IMMA as imma_reader
+import numpy as np
 import pandas as pd
 from shapely.ops import nearest_points
 from shapely.geometry import Point, LineString, MultiPoint
@@ -12,26 +13,177 @@ class IMMA():
 
     # Read the IMMA file and return instance of Route()
 
+    # Fixed width columns of the core attachment: (start, end, scale)
+    core_fields = {
+        'YR': (0, 4, None),
+        'MO': (4, 6, None),
+        'DY': (6, 8, None),
+        'LAT': (12, 17, 0.01),
+        'LON': (17, 23, 0.01),
+        'ID': (34, 43, str),
+    }
+
+    # Length of the core attachment, after which the optional
+    # attachments follow
+    core_length = 108
+
     def __init__(self, file_path):
         self.df = self._parse_imma_file(file_path)
 
-    @staticmethod
-    def _parse_imma_file(file_path):
-        route = []
-        imma_records = imma_reader.get(str(file_path))
-        for record in imma_records:
-            route.append({
-                'year': record['YR'],
-                'month': record['MO'],
-                'day': record['DY'],
-                'lat': record['LAT'],
-                'lon': record['LON']
-            })
-
-        df = pd.DataFrame(route)
+    @classmethod
+    def _parse_imma_file(cls, file_path):
+        core = cls.decode_core(file_path)
+
+        df = pd.DataFrame({
+            'year': core['YR'],
+            'month': core['MO'],
+            'day': core['DY'],
+            'lat': core['LAT'],
+            'lon': core['LON']
+        })
         df = df.dropna()
+        df = df.astype({'year': 'int64', 'month': 'int64', 'day': 'int64'})
         df['datetime'] = pd.to_datetime(df[['day', 'year', 'month']])
         return df
 
+    @classmethod
+    def decode_core(cls, file_path):
+        # Decode the core fields of every record in the file at once -
+        # the fixed width columns of all lines are sliced from the memory
+        # mapped file into 2D arrays of bytes, one row per line
+        data = cls._map_file(file_path)
+
+        ends = np.flatnonzero(data == ord('\n'))
+        if len(data) and data[-1] != ord('\n'):
+            ends = np.append(ends, len(data))
+        starts = np.concatenate([[0], ends + 1])[:len(ends)].astype('int64')
+
+        # Don't count the carriage return of CRLF line endings
+        lengths = ends - starts
+        lengths -= (lengths > 0) & (data[np.maximum(ends - 1, 0)] == ord('\r'))
+
+        core = pd.DataFrame({'offset': starts, 'length': lengths})
+        for field, (start, end, scale) in cls.core_fields.items():
+            chars = cls._get_columns(data, starts, lengths, start, end)
+            if scale is str:
+                core[field] = cls._decode_str(chars)
+            else:
+                core[field] = cls._decode_int(chars) * (scale or 1)
+
+        return core
+
+    @staticmethod
+    def _map_file(file_path):
+        try:
+            return np.memmap(file_path, dtype=np.uint8, mode='r')
+        except ValueError:
+            # Empty files can't be mapped
+            return np.zeros(0, dtype=np.uint8)
+
+    @staticmethod
+    def _get_columns(data, starts, lengths, start, end):
+        # Bytes start:end of each line, with lines too short for
+        # the columns padded with spaces
+        columns = np.arange(start, end)
+        if not len(starts):
+            return np.zeros((0, len(columns)), dtype=np.uint8)
+
+        index = np.minimum(starts[:, None] + columns, len(data) - 1)
+        return np.where(columns < lengths[:, None], data[index], ord(' '))
+
+    @staticmethod
+    def _decode_int(chars):
+        # Signed integers, right aligned - NaN if blank or malformed
+        digits = (chars >= ord('0')) & (chars <= ord('9'))
+        values = np.zeros(len(chars))
+        for i in range(chars.shape[1]):
+            values = np.where(
+                digits[:, i], values * 10 + (chars[:, i] - ord('0')), values)
+
+        sign = np.where((chars == ord('-')).any(axis=1), -1, 1)
+        valid = digits.any(axis=1) & (
+            digits | (chars == ord(' ')) | (chars == ord('-'))).all(axis=1)
+
+        return np.where(valid, values * sign, np.nan)
+
+    @staticmethod
+    def _decode_str(chars):
+        # A log has few distinct IDs, so only decode each once
+        values = chars.astype(np.uint8).view(f'S{chars.shape[1]}').ravel()
+        uniques, codes = np.unique(values, return_inverse=True)
+        uniques = np.array(
+            [u.decode('latin-1').strip() or None for u in uniques], dtype=object)
+        return uniques[codes.ravel()]
+
+    @classmethod
+    def get_supplemental(cls, file_path, offsets):
+        # Supplemental data (SUPD) of the records at the given byte offsets.
+        # The attachments are variable, so each line is walked in turn, and
+        # anything we can't walk is left to pyIMMA
+        try:
+            with open(file_path, 'rb') as f:
+                supd = []
+                for offset in offsets:
+                    f.seek(offset)
+                    supd.append(cls._get_supplemental(f.readline()))
+                return supd
+        except ValueError:
+            lines = dict(zip(cls.get_line_offsets(file_path),
+                             imma_reader.get(str(file_path))))
+            return [lines[offset].get('SUPD') for offset in offsets]
+
+    @classmethod
+    def _get_supplemental(cls, line):
+        line = line.rstrip(b'\r\n')
+        pos = cls.core_length
+
+        # Each attachment starts with its ID (ATTI) and total length (ATTL),
+        # apart from the supplemental attachment 99, which runs to the end
+        # of the line after the ATTE indicator
+        while pos < len(line):
+            atti = int(line[pos:pos + 2])
+            if atti == 99:
+                return line[pos + 5:].decode('latin-1') or None
+            attl = int(line[pos + 2:pos + 4])
+            if attl < 4:
+                raise ValueError(f'Invalid attachment length {attl}')
+            pos += attl
+
+    @staticmethod
+    def get_line_offsets(file_path):
+        # Byte offset of the start of each line (record) in the file
+        offsets = []
+        offset = 0
+        with open(file_path, 'rb') as f:
+            for line in f:
+                offsets.append(offset)
+                offset += len(line)
+        return offsets
+
+    @classmethod
+    def read_records(cls, file_path, offsets):
+        # Decode the core fields of the records at the given byte offsets
+        records = []
+        with open(file_path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                records.append(cls._decode_core(f.readline()))
+        return records
+
+    @classmethod
+    def _decode_core(cls, line):
+        record = {}
+        for field, (start, end, scale) in cls.core_fields.items():
+            value = line[start:end].decode('latin-1').strip()
+            if not value:
+                record[field] = None
+            elif scale is str:
+                record[field] = value
+            elif scale:
+                record[field] = int(value) * scale
+            else:
+                record[field] = int(value)
+        return record
+
     def get_route(self):
         return Route(self.df)
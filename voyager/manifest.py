@@ -0,0 +1,48 @@
+import hashlib
+import json
+
+
+class Manifest():
+
+    # Records the inputs each voyage's output was built from, so voyages
+    # whose inputs haven't changed don't need to be analysed again
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+        try:
+            with self.file_path.open() as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def is_current(self, name, inputs):
+        try:
+            return self.entries[name]['inputs'] == inputs
+        except KeyError:
+            return False
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def update(self, name, inputs, **values):
+        self.entries[name] = dict(inputs=inputs, **values)
+
+    def remove(self, name):
+        self.entries.pop(name, None)
+
+    def save(self):
+        # Write to a temporary file first, so an interrupted run
+        # doesn't leave a corrupt manifest
+        tmp_path = self.file_path.with_suffix('.tmp')
+        with tmp_path.open('w') as f:
+            json.dump(self.entries, f, indent=4)
+        tmp_path.replace(self.file_path)
+
+    @staticmethod
+    def hash_file(file_path):
+        file_hash = hashlib.sha256()
+        with file_path.open('rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                file_hash.update(block)
+        return file_hash.hexdigest()
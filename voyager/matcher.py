@@ -0,0 +1,58 @@
+import re
+import numpy as np
+import pandas as pd
+
+
+class Matcher():
+
+    # Case insensitive search for names within the values of a column.
+    # Columns like recordedBy have far fewer distinct values than rows,
+    # so the values are lower-cased and de-duplicated, and every new name
+    # is searched for in a single pass over the distinct values
+
+    def __init__(self, values):
+        self.codes, self.uniques = pd.factorize(values.str.lower())
+        # Boolean mask of matching distinct values, for each name
+        self._matches = {}
+
+    def add(self, names):
+        # Search for any names we haven't already searched for
+        names = self._normalise(names).difference(self._matches)
+
+        if not names:
+            return
+
+        for name in names:
+            self._matches[name] = np.zeros(len(self.uniques), dtype=bool)
+
+        # Longest first, so at each position the regex matches the longest
+        # name - any other name matching there is a prefix of it
+        names = sorted(names, key=len, reverse=True)
+        prefixes = {
+            name: [n for n in names if name.startswith(n)] for name in names
+        }
+
+        # Lookahead, so overlapping names are all found
+        re_names = re.compile(
+            '(?=({}))'.format('|'.join(map(re.escape, names))))
+
+        for i, value in enumerate(self.uniques):
+            for m in re_names.finditer(value):
+                for name in prefixes[m.group(1)]:
+                    self._matches[name][i] = True
+
+    def search(self, names):
+        # Returns a boolean mask of the rows containing any of the names
+        names = self._normalise(names)
+        self.add(names)
+
+        # Extra last value is for missing values, which have code -1
+        mask = np.zeros(len(self.uniques) + 1, dtype=bool)
+        for name in names:
+            mask[:-1] |= self._matches[name]
+
+        return mask[self.codes]
+
+    @staticmethod
+    def _normalise(names):
+        return {name.lower() for name in names if name}
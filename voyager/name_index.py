@@ -0,0 +1,119 @@
+import re
+import numpy as np
+import pandas as pd
+
+from voyager.matcher import Matcher
+
+re_token = re.compile(r'\w+')
+
+
+class NameIndex():
+
+    # Inverted index of the tokens in GBIF name columns to gbifIDs. Built once
+    # from the GBIF cache, so matching a name is a lookup into the (small)
+    # token vocabulary rather than a scan of every GBIF record
+
+    fields = ['recordedBy', 'vessel', 'expedition']
+
+    def __init__(self, vocabularies, field_codes, token_codes, gbif_ids):
+        # The index is held as numpy arrays - rows of (field code, token
+        # code, gbifID), sorted by field and token, with the distinct
+        # tokens of each field in its vocabulary. So only the vocabulary
+        # is held as strings, whatever the size of the GBIF download
+        self._fields = {}
+
+        field_bounds = np.searchsorted(
+            field_codes, np.arange(len(self.fields) + 1))
+
+        for i, field in enumerate(self.fields):
+            start, end = field_bounds[i], field_bounds[i + 1]
+            vocabulary = vocabularies.get(field, [])
+
+            # Each token's gbifIDs are a contiguous slice
+            bounds = np.searchsorted(
+                token_codes[start:end], np.arange(len(vocabulary) + 1))
+
+            self._fields[field] = (
+                Matcher(pd.Series(vocabulary, dtype=object)),
+                gbif_ids[start:end],
+                bounds
+            )
+
+    def search(self, field, names):
+        # Returns gbifIDs where field contains any of the names
+        gbif_ids = [self._search_name(field, name) for name in names if name]
+
+        if not gbif_ids:
+            return np.array([], dtype='int64')
+
+        return np.unique(np.concatenate(gbif_ids))
+
+    def _search_name(self, field, name):
+        # A name with multiple tokens has to match all of them
+        tokens = self.tokenise(name) or [name]
+
+        gbif_ids = self._search_token(field, tokens[0])
+        for token in tokens[1:]:
+            gbif_ids = np.intersect1d(
+                gbif_ids, self._search_token(field, token))
+
+        return gbif_ids
+
+    def _search_token(self, field, token):
+        try:
+            matcher, gbif_ids, bounds = self._fields[field]
+        except KeyError:
+            return np.array([], dtype='int64')
+
+        # Tokens are matched as substrings of the vocabulary
+        slices = [
+            gbif_ids[bounds[i]:bounds[i + 1]]
+            for i in np.flatnonzero(matcher.search([token]))
+        ]
+
+        if not slices:
+            return np.array([], dtype='int64')
+
+        return np.unique(np.concatenate(slices))
+
+    @staticmethod
+    def tokenise(name):
+        return re_token.findall(name.lower())
+
+    @classmethod
+    def encode_tokens(cls, df, field):
+        # Returns the vocabulary of field's tokens, and the frame of
+        # (field code, token code, gbifID) rows for the index
+        tokens = cls.get_tokens(df, field)
+        codes, vocabulary = pd.factorize(tokens['token'], sort=True)
+
+        rows = pd.DataFrame({
+            'field_code': np.int8(cls.fields.index(field)),
+            'token_code': codes.astype('int32'),
+            'gbifID': tokens['gbifID'].values.astype('int64')
+        })
+
+        return pd.Series(vocabulary, dtype=object), rows.sort_values(
+            by=['token_code', 'gbifID'], kind='stable')
+
+    @classmethod
+    def get_tokens(cls, df, field):
+        # Returns a frame of (token, gbifID) for a frame of GBIF records.
+        # Distinct values are only tokenised once
+        codes, uniques = pd.factorize(df[field].str.lower())
+
+        tokens = pd.Series(uniques, dtype=object).str.findall(
+            re_token.pattern).explode().dropna()
+        tokens = pd.DataFrame({
+            'code': tokens.index,
+            'token': tokens.values
+        })
+
+        rows = pd.DataFrame({
+            'code': codes,
+            'gbifID': df['gbifID'].values
+        })
+
+        df = rows[rows['code'] >= 0].merge(tokens, on='code')
+
+        return df[['token', 'gbifID']]
@@ -5,10 +5,11 @@ import calendar
 from datetime import datetime
 from shapely.geometry import Point
 from shapely.ops import nearest_points
-import math
+import json
 
 from voyager.config import logger
 from voyager.utils import extract_surname
+from voyager.dwca import DwCA
 from geopy.distance import geodesic
 
 
@@ -19,6 +20,9 @@ class Occurrences():
     # Must be within X km on the day of the route
     MAX_KM_TO_ROUTE = 100
 
+    # Number of rows written to the DwC-A at a time
+    DWCA_CHUNK_SIZE = 10000
+
     pd.options.mode.chained_assignment = None
 
     def __init__(self, route, gbif, vessel, collectors=[], expedition=None):
@@ -29,8 +33,7 @@ class Occurrences():
         self.expedition = expedition
         self.inferred_collectors = {}
         self.gbif = gbif.get_years(route.year_from, route.year_to)
-        # Set GBIF datetime data type
-        self._add_gbif_datetime()
+        self.name_index = gbif.get_name_index()
         self._add_additional_columns()
         self.df = self._get_occurences()
 
@@ -41,36 +44,64 @@ class Occurrences():
         if self.df.empty:
             return
 
-        def concatenateIssue(row):
-            if row._error:
-                try:
-                    is_nan = math.isnan(row.issue)
-                except TypeError:
-                    is_nan = False
-                if row.issue and not is_nan:
-                    row.issue += f';{row._error}'
-                else:
-                    row.issue = row._error
-
-            return row.issue
-
-        df = self.df.copy()
-        df['dynamicProperties'] = np.nan
-
-        df['dynamicProperties'] = df.apply(
-            lambda row: {
-                'vessel': self.vessel,
-                'distance': row['_distance'],
-                'voyagerInferrences': row['_inferred_on']
-            }, axis=1)
-
-        df['issue'] = df.apply(concatenateIssue, axis=1)
-        df.drop(self.additional_columns, axis=1, inplace=True)
-        # We merged these in from dynamicProperties
-        df.drop(['vessel', 'expedition', 'datetime'], axis=1, inplace=True)
-        df.drop(df.filter(regex="Unname"), axis=1, inplace=True)
+        DwCA(file_path).write(
+            self._get_dwca_chunks(),
+            self._get_dwca_columns(),
+            title=f'{self.vessel} {self.route.year_from} - {self.route.year_to}'
+        )
+
         logger.info('Saved DWC-A %s', file_path)
-        df.to_csv(file_path, index=False)
+
+    def _get_dwca_chunks(self):
+        # The dynamicProperties & issue columns are built a chunk at a time,
+        # so the frame is never copied in full
+        for start in range(0, self.df.shape[0], self.DWCA_CHUNK_SIZE):
+            df = self.df.iloc[start:start + self.DWCA_CHUNK_SIZE]
+            yield df.assign(
+                dynamicProperties=self._get_dynamic_properties(df),
+                issue=self._get_issue(df)
+            )
+
+    def _get_dwca_columns(self):
+        # We merged these in to dynamicProperties
+        excluded = self.additional_columns + ['vessel', 'expedition', 'datetime']
+
+        # gbifID first, as it's the archive's ID
+        columns = ['gbifID'] + [
+            c for c in self.df.columns
+            if c not in excluded + ['gbifID'] and not c.startswith('Unname')
+        ]
+
+        for column in ['dynamicProperties', 'issue']:
+            if column not in columns:
+                columns.append(column)
+
+        return columns
+
+    def _get_dynamic_properties(self, df):
+        # Build the dynamicProperties JSON with string operations on the
+        # columns, rather than serialising a dict for every row
+        distance = df['_distance'].astype(float)
+        distance = distance.astype(str).where(distance.notnull(), 'null')
+
+        inferred_on = df['_inferred_on'].map({
+            i: json.dumps(i) for i in df['_inferred_on'].dropna().unique()
+        }).fillna('null')
+
+        return '{"vessel": ' + json.dumps(self.vessel) + \
+            ', "distance": ' + distance + \
+            ', "voyagerInferrences": ' + inferred_on + '}'
+
+    @staticmethod
+    def _get_issue(df):
+        # Append any error to the GBIF issues
+        issue = df['issue']
+        error = df['_error']
+
+        has_issue = issue.notnull() & (issue != '')
+        merged = (issue + ';' + error).where(has_issue, error)
+
+        return issue.where(error.isnull(), merged)
 
     def get_stats(self):
         stats = {
@@ -83,10 +114,6 @@ class Occurrences():
     def infererence_count(self):
         return self.df[self.df['_date'].notnull() | self.df['_lat'].notnull()].shape[0]
 
-    def _add_gbif_datetime(self):
-        self.gbif['datetime'] = pd.to_datetime(
-            self.gbif['datetime'], infer_datetime_format=True)
-
     def _add_additional_columns(self):
         for column in self.additional_columns:
             self.gbif[column] = np.nan
@@ -113,16 +140,14 @@ class Occurrences():
 
             return pd.DataFrame()
 
-    def _get_location_by_date(self, date):
-        location = self.route.get_location_by_date(date)
+    def _search(self, field, names):
+        # Get GBIF records where field contains any of the names
+        gbif_ids = self.name_index.search(field, names)
+        return self.gbif[self.gbif['gbifID'].isin(gbif_ids)]
 
-        if not location:
-            location = [np.nan, np.nan]
-
-        return pd.Series(location)
-
-    def _get_date_by_location(self, latitude, longitude):
-        return self.route.get_date_by_location(latitude, longitude)
+    def _get_vessels(self):
+        # Voyages with multiple vessels are joined with +
+        return self.vessel.split('+')
 
     def _get_occurences_by_vessel(self):
 
@@ -130,13 +155,7 @@ class Occurrences():
         for field in ['vessel', 'expedition']:
             if self.gbif[field].any():
 
-                if '+' in self.vessel:
-                    vessels = self.vessel.split('+')
-                    df = self.gbif[self.gbif[field].str.contains(
-                        '|'.join(vessels), case=False, na=False, regex=True)]
-                else:
-                    df = self.gbif[self.gbif[field].str.contains(
-                        self.vessel, case=False, na=False)]
+                df = self._search(field, self._get_vessels())
 
                 df['_inferred_on'] = field
 
@@ -150,8 +169,7 @@ class Occurrences():
 
     def _get_occurences_by_expedition(self):
         if self.gbif['expedition'].any():
-            df = self.gbif[self.gbif['expedition'].str.contains(
-                self.expedition, case=False, na=False)]
+            df = self._search('expedition', [self.expedition])
 
             df['_inferred_on'] = 'expedition'
 
@@ -168,8 +186,7 @@ class Occurrences():
 
     def _get_occurences_by_collector(self):
 
-        df = self.gbif[self.gbif['recordedBy'].str.contains(
-            '|'.join(self.collectors), case=False, na=False)]
+        df = self._search('recordedBy', self.collectors)
 
         df['_inferred_on'] = 'collector'
 
@@ -198,8 +215,7 @@ class Occurrences():
 
         if collectors:
 
-            df = self.gbif[self.gbif['recordedBy'].str.contains(
-                '|'.join(collectors), case=False, na=False)]
+            df = self._search('recordedBy', collectors)
 
             df['_inferred_on'] = 'inferred_collector'
 
@@ -235,13 +251,17 @@ class Occurrences():
                 # We're calculating the lat/lon from the date, so distance will always be 0
                 date_not_location['_distance'] = 0
 
-                date_not_location[['decimalLatitude', 'decimalLongitude']] = date_not_location['datetime'].apply(
-                    self._get_location_by_date)
+                locations = self.route.get_locations_by_dates(
+                    date_not_location['datetime'])
+
+                date_not_location['decimalLatitude'] = locations[:, 0]
+                date_not_location['decimalLongitude'] = locations[:, 1]
 
                 # Make sure we don;t have any NaNs
-                date_not_location = date_not_location[df['decimalLatitude'].notna(
-                ) & df['decimalLongitude'].notna(
-                )]
+                date_not_location = date_not_location[
+                    date_not_location['decimalLatitude'].notna()
+                    & date_not_location['decimalLongitude'].notna()
+                ]
 
                 logger.info('%s occurences with date and inferred location.',
                             date_not_location.shape[0])
@@ -255,9 +275,12 @@ class Occurrences():
 
                 location_not_date['_error'] = 'RECORDED_DATE_INFERRED'
 
-                location_not_date['datetime'] = location_not_date.apply(
-                    lambda row: self._get_date_by_location(
-                        row['decimalLatitude'], row['decimalLongitude']), axis=1)
+                dates, _ = self.route.get_dates_by_locations(
+                    location_not_date['decimalLatitude'],
+                    location_not_date['decimalLongitude']
+                )
+
+                location_not_date['datetime'] = dates.values
 
                 logger.info('%s occurences with location and inferred date.',
                             location_not_date.shape[0])
@@ -278,21 +301,15 @@ class Occurrences():
         logger.info('Calculating distance for %s occurences.',
                     mask.sum())
 
-        df['_distance'] = df.apply(
-            lambda row: row['_distance'] if row['_distance'] >= 0 else self._calc_geodesic_distance(
-                row['datetime'],
-                row['decimalLatitude'],
-                row['decimalLongitude']
-            ),
-            axis=1
+        df.loc[mask, '_distance'] = self.route.get_distances(
+            df.loc[mask, 'datetime'],
+            df.loc[mask, 'decimalLatitude'],
+            df.loc[mask, 'decimalLongitude'],
+            refine_near=self.MAX_KM_TO_ROUTE
         )
 
         return df
 
-    def _calc_geodesic_distance(self, datetime, latitude, longitude):
-        # Get nearest point on route
-        return self.route.get_distance(datetime, latitude, longitude)
-
     def _get_occurences_by_geotemporal_proximity(self):
 
         # Have to have date so lets filter on date range
@@ -301,7 +318,19 @@ class Occurrences():
             (self.gbif.datetime <= self.route.date_to)
         ]
 
-        df = self._add_distance_to_route(df)
+        # Discard occurrences outside the route's bounding box on their date,
+        # before calculating the distance to the route
+        in_bounding_box = self.route.in_bounding_boxes(
+            df['datetime'],
+            df['decimalLatitude'],
+            df['decimalLongitude'],
+            self.MAX_KM_TO_ROUTE
+        )
+
+        logger.info('%s of %s occurrences within bounding box of route',
+                    in_bounding_box.sum(), df.shape[0])
+
+        df = self._add_distance_to_route(df[in_bounding_box])
         df = df[df['_distance'] < self.MAX_KM_TO_ROUTE]
         df['_inferred_on'] = 'route_proximity'
 
@@ -3,12 +3,13 @@ from dateutil.relativedelta import relativedelta
 import pandas as pd
 import IMMA as imma_reader
 import numpy as np
-from shapely.ops import nearest_points
 from shapely.geometry import Point, LineString, MultiPoint
 from geopy.distance import geodesic
+from sklearn.neighbors import BallTree
 
 
 from voyager.config import OUTPUT_DIR, VOYAGES_DIR, logger
+from voyager.utils import haversine, EARTH_RADIUS_KM
 
 
 class Route():
@@ -17,12 +18,18 @@ class Route():
     INTERPOLATION_MAX_DAYS = 50
     # If there's a gap greater than max_days and max_distance, do not interpolate between those points
     INTERPOLATION_MAX_DISTANCE = 250
+    # Haversine distances within this fraction of a threshold are refined
+    # with the exact geodesic distance
+    GEODESIC_REFINEMENT_TOLERANCE = 0.01
 
     def __init__(self, df):
         self.df = df.sort_values(by=['datetime'])
         self.interpolated = self.interpolate()
-        self.points = MultiPoint(
-            [Point(p) for p in self.interpolated[['lon', 'lat']].values])
+        self._index_days()
+        self._bounding_boxes = {}
+        # Haversine ball tree of the daily route, for nearest day queries
+        self._tree = BallTree(
+            np.radians(self.interpolated[['lat', 'lon']].values), metric='haversine')
 
     @property
     def date_from(self):
@@ -42,12 +49,9 @@ class Route():
 
     def get_location_by_date(self, date):
 
-        location = self.interpolated.loc[self.interpolated.index == date, [
-            'lat', 'lon']]
+        location = self.get_locations_by_dates([date])[0]
 
-        try:
-            location = location.iloc[0]
-        except IndexError:
+        if np.isnan(location).any():
             if date > self.date_to:
                 logger.debug(
                     f'Occurrence dated {date} is after voyage end date {self.date_to}')
@@ -61,18 +65,108 @@ class Route():
         else:
             return location.tolist()
 
+    def get_locations_by_dates(self, dates):
+        # Returns an array of [lat, lon] for each date - NaN if the
+        # date is outside the voyage (or in a gap between stages)
+        offsets = self._get_day_offsets(dates)
+        in_range = (offsets >= 0) & (offsets < len(self._locations))
+
+        locations = np.full((len(offsets), 2), np.nan)
+        locations[in_range] = self._locations[offsets[in_range]]
+        return locations
+
+    def in_bounding_boxes(self, dates, latitudes, longitudes, km):
+        # Cheap test of whether each location falls inside a box, padded by
+        # km, around the route location on its date. Anything outside the box
+        # cannot be within km of the route
+        lat_padding, lon_padding = self._get_bounding_boxes(km)
+
+        offsets = self._get_day_offsets(dates)
+        in_range = (offsets >= 0) & (offsets < len(self._locations))
+        offsets[~in_range] = 0
+
+        locations = self._locations[offsets]
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+
+        lat_diff = np.abs(latitudes - locations[:, 0])
+        # Wrap longitude differences around the antimeridian
+        lon_diff = np.abs((longitudes - locations[:, 1] + 180) % 360 - 180)
+
+        return in_range & (lat_diff <= lat_padding) & \
+            (lon_diff <= lon_padding[offsets])
+
+    def _get_bounding_boxes(self, km):
+        # Per day lat/lon padding around the route, in degrees. Padded a little
+        # further so they also contain the geodesic (ellipsoid) distance
+        try:
+            return self._bounding_boxes[km]
+        except KeyError:
+            pass
+
+        angle = km / EARTH_RADIUS_KM * (1 + self.GEODESIC_REFINEMENT_TOLERANCE)
+        lat_padding = np.degrees(angle)
+
+        # Longitude padding widens towards the poles - if the box would
+        # reach a pole, any longitude is in range
+        cos_lat = np.cos(np.radians(self._locations[:, 0]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.sin(angle) / cos_lat
+        lon_padding = np.where(
+            ratio < 1, np.degrees(np.arcsin(np.clip(ratio, 0, 1))), 180)
+
+        self._bounding_boxes[km] = (lat_padding, lon_padding)
+        return self._bounding_boxes[km]
+
+    def _index_days(self):
+        # Locations are stored in an array with one row per day of the voyage,
+        # so a date can be resolved by its offset from the first day
+        days = self._to_days(self.interpolated.index)
+        self._first_day = days.min()
+        offsets = days - self._first_day
+
+        self._locations = np.full((offsets.max() + 1, 2), np.nan)
+        # Where stages meet on the same day, use the first location
+        offsets, first = np.unique(offsets, return_index=True)
+        self._locations[offsets] = self.interpolated[[
+            'lat', 'lon']].values[first]
+
+    def _get_day_offsets(self, dates):
+        return self._to_days(dates) - self._first_day
+
+    @staticmethod
+    def _to_days(dates):
+        # NaT becomes the minimum int64, which is never in range
+        days = np.asarray(pd.DatetimeIndex(dates), dtype='datetime64[D]')
+        return days.astype('int64')
+
     def get_date_by_location(self, latitude, longitude):
 
-        point = Point(float(longitude), float(latitude))
-        origin, nearest = nearest_points(point, self.points)
-        date = self.interpolated[
-            (self.interpolated.lon == nearest.x) &
-            (self.interpolated.lat == nearest.y)
-        ].index[0]
+        dates, _ = self.get_dates_by_locations(
+            [float(latitude)], [float(longitude)])
+        date = dates[0]
 
         if date >= self.date_from and date <= self.date_to:
             return date
 
+    def get_dates_by_locations(self, latitudes, longitudes):
+        # Returns the date of the nearest day on the route to each location,
+        # and the distance to it in km - NaT and NaN if there is no location
+        points = np.column_stack([latitudes, longitudes]).astype(float)
+        has_location = ~np.isnan(points).any(axis=1)
+
+        dates = np.full(len(points), np.datetime64('NaT'),
+                        dtype='datetime64[ns]')
+        distances = np.full(len(points), np.nan)
+
+        if has_location.any():
+            distance, index = self._tree.query(
+                np.radians(points[has_location]), k=1)
+            dates[has_location] = self.interpolated.index.values[index[:, 0]]
+            distances[has_location] = distance[:, 0] * EARTH_RADIUS_KM
+
+        return pd.DatetimeIndex(dates), distances
+
     def get_distance(self, date, latitude, longitude):
         point_on_date = self.get_location_by_date(date)
         try:
@@ -82,29 +176,42 @@ class Route():
 
         return geodesic(point_on_date, point).kilometers
 
+    def get_distances(self, dates, latitudes, longitudes, refine_near=None):
+        # Great-circle distance in km from each location to the route on its
+        # date - NaN if there's no location on the route for that date
+        locations = self.get_locations_by_dates(dates)
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+
+        distances = haversine(
+            locations[:, 0], locations[:, 1], latitudes, longitudes)
+
+        if refine_near:
+            # The haversine is within ~0.5% of the geodesic, so only distances
+            # close to the threshold can fall on the wrong side of it
+            refine = np.abs(distances - refine_near) <= \
+                refine_near * self.GEODESIC_REFINEMENT_TOLERANCE
+
+            for i in np.flatnonzero(refine):
+                distances[i] = geodesic(
+                    locations[i], (latitudes[i], longitudes[i])).kilometers
+
+        return distances
+
     def interpolate(self):
         df = self.df.copy()
 
         df['date_diff'] = (df['datetime'] - df['datetime'].shift(1)).dt.days
         df.reset_index(drop=True, inplace=True)
 
-        interpolation_break_points = []
-        for index, row in df.iterrows():
+        # Break the voyage where there's a long gap in both time and distance
+        distance = haversine(
+            df['lat'].shift(1), df['lon'].shift(1), df['lat'], df['lon'])
 
-            if row['date_diff'] > self.INTERPOLATION_MAX_DAYS:
-                try:
-                    previous_point = (previous_row.lat, previous_row.lon)
-                except NameError:
-                    # Not defined on first loop
-                    pass
-                else:
-                    point = (row.lat, row.lon)
-                    previous_point = (previous_row.lat, previous_row.lon)
-                    distance = geodesic(previous_point, point).kilometers
-                    if distance > self.INTERPOLATION_MAX_DISTANCE:
-                        interpolation_break_points.append(index)
-
-            previous_row = row
+        interpolation_break_points = df.index[
+            (df['date_diff'] > self.INTERPOLATION_MAX_DAYS)
+            & (distance > self.INTERPOLATION_MAX_DISTANCE)
+        ].tolist()
 
         if interpolation_break_points:
             logger.info('Splitting voyage into %s stages.',
@@ -139,20 +246,10 @@ class Route():
     def _interpolate_split_antemeridian(self, df):
         # Do not interpolate over the antemeridian
         df.reset_index(drop=True, inplace=True)
-        break_points = []
-        for index, row in df.iterrows():
-            try:
-                previous_row_is_positive = abs(
-                    previous_row['lon']) == previous_row['lon']
-            except NameError:
-                # Not defined first loop
-                pass
-            else:
-                row_is_positive = abs(row['lon']) == row['lon']
-                if row_is_positive != previous_row_is_positive:
-                    break_points.append(index)
-
-            previous_row = row
+        # Break wherever the longitude changes sign
+        is_positive = (df['lon'] >= 0).values
+        break_points = (np.flatnonzero(
+            is_positive[1:] != is_positive[:-1]) + 1).tolist()
 
         if break_points:
             return self._split_df_into_frames(df, break_points)
@@ -181,7 +278,7 @@ class Route():
         if not df.empty:
             return MultiPoint([Point(p) for p in df[['lon', 'lat']].values])
 
-    def get_coordinates(self):
+    def get_coordinates(self, tolerance=None):
         df = self.interpolated.copy()
 
         df.reset_index(level=0, inplace=True)
@@ -192,8 +289,68 @@ class Route():
         # print(df[df['lon'].between(-1, 1)].head())
         # df.index = df['datetime']
 
+        # Simplify the route, to within tolerance (in degrees)
+        if tolerance:
+            df = df[self._simplify(df, tolerance)]
+
         return df[['lon', 'lat', 'timestamp']]
 
+    def _simplify(self, df, tolerance):
+        # Returns a boolean mask of the points to keep. The route is
+        # simplified between breaks - gaps between stages, antemeridian
+        # crossings and missing points - which are always kept
+        lon = df['lon'].values
+        lat = df['lat'].values
+        is_finite = np.isfinite(lon) & np.isfinite(lat)
+
+        breaks = np.flatnonzero(
+            (np.diff(df['datetime'].values) != np.timedelta64(1, 'D'))
+            | (np.abs(np.diff(lon)) > 180)
+            | ~is_finite[1:]
+            | ~is_finite[:-1]
+        ) + 1
+        bounds = np.concatenate([[0], breaks, [len(df)]])
+
+        keep = ~is_finite
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if is_finite[start]:
+                keep[start:end] = self._douglas_peucker(
+                    lon[start:end], lat[start:end], tolerance)
+
+        return keep
+
+    @staticmethod
+    def _douglas_peucker(x, y, tolerance):
+        keep = np.zeros(len(x), dtype=bool)
+        keep[[0, -1]] = True
+
+        sections = [(0, len(x) - 1)]
+        while sections:
+            start, end = sections.pop()
+            if end - start < 2:
+                continue
+
+            # Distance of the points between start & end from the line
+            # joining them - or from start, if they're the same point
+            dx = x[end] - x[start]
+            dy = y[end] - y[start]
+            px = x[start + 1:end] - x[start]
+            py = y[start + 1:end] - y[start]
+
+            length = np.hypot(dx, dy)
+            if length:
+                distances = np.abs(dx * py - dy * px) / length
+            else:
+                distances = np.hypot(px, py)
+
+            i = np.argmax(distances)
+            if distances[i] > tolerance:
+                i += start + 1
+                keep[i] = True
+                sections += [(start, i), (i, end)]
+
+        return keep
+
     def _normalise_antimeridian(self, df):
         # The voyage data has 0.x and -0.x when the route crosses the antimeridian (180)
         # So these need to be normalised into +- 180 range
@@ -1,4 +1,8 @@
 import re
+import numpy as np
+
+# Mean radius of the earth, in km
+EARTH_RADIUS_KM = 6371.0088
 
 # Regex
 re_last_name = re.compile(r'[a-zA-Z]{3,}')
@@ -23,3 +27,11 @@ def extract_surname(name):
         return names[-1]
     except IndexError:
         pass
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    # Great-circle distance in km - accepts scalars or arrays
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))